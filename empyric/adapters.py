@@ -1,9 +1,18 @@
 import importlib
 import functools
+import os
+import json
 import time
 import warnings
 import sys
 import re
+import socket
+import struct
+import threading
+import collections
+import queue
+import numpy as np
+from contextlib import contextmanager
 
 
 def chaperone(method):
@@ -24,14 +33,28 @@ def chaperone(method):
         :return: (str/float/int/bool) instrument response, if valid
         """
 
-        if not self.connected:
-            raise ConnectionError(f'Adapter is not connected for instrument at address {self.instrument.address}')
+        if self.nested:  # already running within a bounded call of this adapter, e.g. while connecting
+            return method(self, *args, **kwargs)
+
+        with self.bus.transaction(self.instrument.address):
+
+            if self.suspect:
+                self.recover()
+
+            if not self.connected:
+                raise ConnectionError(f'Adapter is not connected for instrument at address {self.instrument.address}')
+
+            return attempt(self, *args, validator=validator, **kwargs)
+
+    def attempt(self, *args, validator=None, **kwargs):
 
         # Catch communication errors and either try to repeat communication or reset the connection
         if self.reconnects < self.max_reconnects:
             if self.repeats < self.max_repeats:
                 try:
-                    response = method(self, *args, **kwargs)
+                    # the call runs on the adapter's worker thread, which is abandoned if it hangs past the deadline
+                    response = run_with_deadline(method, self.call_deadline, args=(self,) + args, kwargs=kwargs,
+                                                 bus=self.bus, worker=self.worker)
 
                     valid_response = True
                     if validator:
@@ -44,11 +67,18 @@ def chaperone(method):
                     else:
                         raise ValueError('invalid response!')
 
+                except DeadlineError as err:
+                    self.abandon()
+                    raise ConnectionError(f'{err}; the adapter of {self.instrument} is suspect until it reconnects')
+
+                except (NotImplementedError, TypeError):
+                    raise  # unsupported or malformed calls fail the same way every time, so don't repeat them
+
                 except BaseException as err:
                     warnings.warn(
                         f'Encountered {err} while trying to read from {self.instrument}')
                     self.repeats += 1
-                    return wrapped_method(self, *args, validator=validator, **kwargs)
+                    return attempt(self, *args, validator=validator, **kwargs)
             else:
                 self.disconnect()
                 time.sleep(self.delay)
@@ -56,13 +86,455 @@ def chaperone(method):
 
                 self.repeats = 0
                 self.reconnects += 1
-                return wrapped_method(self, *args, validator=validator, **kwargs)
+                return attempt(self, *args, validator=validator, **kwargs)
         else:
             raise ConnectionError(f'Unable to communicate with instrument at address {self.instrument.address}!')
 
     return wrapped_method
 
 
+def bounded(method):
+    """
+    Wraps all write methods of adapters; writes are not repeated like reads and queries, but they are held to the call
+    deadline, so that a wedged backend does not stall the experiment
+
+    :param method: (callable) method to be wrapped
+    :return: (callable) wrapped method
+    """
+
+    @functools.wraps(method)
+    def wrapped_method(self, *args, **kwargs):
+
+        # writes made while connecting are bounded by the connect deadline instead
+        if self.nested or not self.connected:
+            return method(self, *args, **kwargs)
+
+        with self.bus.transaction(self.instrument.address):
+
+            if self.suspect:
+                self.recover()
+
+            return self.call_with_deadline(method, self.call_deadline, self, *args, **kwargs)
+
+    return wrapped_method
+
+
+class Bus:
+    """
+    Serializes access to a communication channel that is shared by several devices.
+
+    Requests are granted one at a time; consecutive requests for the device that currently holds the bus are served
+    ahead of requests for other devices (up to max_burst in a row), which minimizes address switching on the bus.
+    The bus is reentrant, so a thread holding it can nest transactions. While its owner suspends it, the device of the
+    owner stays reserved for the owner's thread, so only other devices can use the bus in the meantime.
+    """
+
+    max_burst = 8  # maximum number of consecutive grants to one device while other devices are waiting
+
+    def __init__(self, name=None):
+
+        self.name = name
+
+        self.condition = threading.Condition()
+        self.owner = None  # thread currently holding the bus
+        self.depth = 0  # number of nested acquisitions by the owner
+        self.device = None  # device most recently granted the bus
+        self.burst = 0  # number of consecutive grants to that device
+        self.waiting = []  # devices and threads waiting for the bus, as (device, thread) pairs
+        self.reserved = {}  # devices reserved by threads which suspended the bus, of the form {device: thread}
+
+    def __repr__(self):
+        return f'Bus({self.name})'
+
+    def _reserved(self, device, thread):
+        # whether the device is reserved for a thread other than the given one
+        return device in self.reserved and self.reserved[device] is not thread
+
+    def _available(self, device, thread):
+
+        if self.owner is not None or self._reserved(device, thread):
+            return False
+
+        # waiting threads which cannot take the bus yet do not hold up the others
+        waiting = [waiting for waiting, other in self.waiting if not self._reserved(waiting, other)]
+
+        others_waiting = any(waiting != self.device for waiting in waiting)
+
+        if device == self.device:
+            return self.burst < self.max_burst or not others_waiting
+        else:
+            return self.device not in waiting or self.burst >= self.max_burst
+
+    def acquire(self, device=None):
+        """
+        Block until the bus is available for the given device, then take it
+
+        :param device: (hashable) identifier of the device on the bus, e.g. its address
+        :return: None
+        """
+
+        thread = threading.current_thread()
+
+        with self.condition:
+
+            if self.owner is thread:
+                self.depth += 1
+                return
+
+            self.waiting.append((device, thread))
+            try:
+                while not self._available(device, thread):
+                    self.condition.wait()
+            finally:
+                self.waiting.remove((device, thread))
+
+            self.owner = thread
+            self.depth = 1
+
+            if device == self.device:
+                self.burst += 1
+            else:
+                self.device = device
+                self.burst = 1
+
+    def release(self):
+
+        with self.condition:
+
+            if self.owner is not threading.current_thread():
+                raise RuntimeError(f'{self} released by a thread that does not hold it!')
+
+            self.depth -= 1
+
+            if self.depth == 0:
+                self.owner = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def suspended(self):
+        """
+        Context manager which gives up the bus, even from within nested transactions, and takes it back afterwards;
+        lets other devices use the bus while its owner waits, e.g. for a long operation of an instrument to complete.
+        The owner's device stays reserved in the meantime, so other threads cannot address it.
+        """
+
+        thread = threading.current_thread()
+
+        with self.condition:
+
+            if self.owner is not thread:
+                held = False
+            else:
+                held = True
+                device, depth = self.device, self.depth
+                reserving = device not in self.reserved  # an outer suspension may already hold the reservation
+
+                self.reserved[device] = thread
+                self.owner = None
+                self.depth = 0
+                self.condition.notify_all()
+
+        try:
+            yield self
+        finally:
+            if held:
+                self.acquire(device)
+                with self.condition:
+                    self.depth = depth
+                    if reserving:
+                        del self.reserved[device]
+                    self.condition.notify_all()
+
+    @contextmanager
+    def lent(self, thread):
+        """
+        Context manager which lends the bus, with any nested transactions, to another thread acting on behalf of the
+        owner, e.g. a worker running a call with a deadline; the bus is taken back afterwards, even if the other thread
+        is not done with it
+        """
+
+        with self.condition:
+            held = self.owner is threading.current_thread()
+
+            if held:
+                depth = self.depth
+                self.owner = thread
+
+        try:
+            yield self
+        finally:
+            if held:
+                with self.condition:
+                    self.owner = threading.current_thread()
+                    self.depth = depth
+
+    @contextmanager
+    def transaction(self, device=None):
+        """
+        Context manager which holds the bus for the duration of a transaction with a device
+
+        :param device: (hashable) identifier of the device on the bus, e.g. its address
+        """
+
+        self.acquire(device)
+        try:
+            yield self
+        finally:
+            self.release()
+
+
+class DeadlineError(TimeoutError):
+    """
+    Raised when a call does not return before its deadline
+    """
+    pass
+
+
+class DeadlineWorker:
+    """
+    Reusable worker thread which runs calls for run_with_deadline, one at a time. A worker whose call hangs past its
+    deadline is retired: its thread is left to finish the call on its own and then exits, and a new worker takes over.
+    """
+
+    def __init__(self, name=None):
+
+        self.jobs = queue.Queue()
+        self.retired = False
+
+        self.thread = threading.Thread(target=self._work, name=name, daemon=True)
+        self.thread.start()
+
+    def _work(self):
+
+        while not self.retired:
+            job = self.jobs.get()
+
+            if job is None:
+                return
+
+            job()
+
+    def submit(self, job):
+        self.jobs.put(job)
+
+    def stop(self):
+        self.jobs.put(None)
+
+
+def run_with_deadline(function, deadline, args=(), kwargs=None, cleanup=None, bus=None, worker=None):
+    """
+    Run a function on a worker thread and wait for it to return until the deadline passes
+
+    :param function: (callable) function to run
+    :param deadline: (float) maximum time to wait, in seconds; if None, the function is called directly
+    :param args: (tuple) positional arguments of the function
+    :param kwargs: (dict) keyword arguments of the function
+    :param cleanup: (callable) function called with the return value if the function returns after the deadline
+    :param bus: (Bus) bus held by the calling thread, which is lent to the worker while waiting for it
+    :param worker: (DeadlineWorker) reusable worker to run the function on; if None, a thread is started for the call
+    :return: return value of the function
+    """
+
+    if kwargs is None:
+        kwargs = {}
+
+    if deadline is None or (worker is not None and worker.thread is threading.current_thread()):
+        return function(*args, **kwargs)
+
+    outcome = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def work():
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            with lock:
+                outcome['error'] = error
+            done.set()
+            return
+
+        with lock:
+            late = outcome.get('abandoned', False)
+            outcome['result'] = result
+        done.set()
+
+        if late and cleanup:
+            try:
+                cleanup(result)
+            except BaseException:
+                pass
+
+    if worker is None:
+        thread = threading.Thread(target=work, daemon=True)
+        start = thread.start
+    else:
+        thread = worker.thread
+        start = functools.partial(worker.submit, work)
+
+    if bus is not None:
+        with bus.lent(thread):
+            start()
+            done.wait(deadline)
+    else:
+        start()
+        done.wait(deadline)
+
+    with lock:
+        if 'result' in outcome:
+            return outcome['result']
+        elif 'error' in outcome:
+            raise outcome['error']
+        else:
+            outcome['abandoned'] = True  # the worker is left to finish on its own
+            if worker is not None:
+                worker.retired = True
+            raise DeadlineError(f'{getattr(function, "__name__", function)} did not return within {deadline} s')
+
+
+class ProbeCache:
+    """
+    On-disk record of the adapter class that last connected to each instrument, so that it can be tried first instead
+    of probing every supported adapter; only the class name is recorded, since connection settings come from the
+    instrument's supported adapters and the runcard of each run
+    """
+
+    path = os.path.join(os.path.expanduser('~'), '.empyric', 'adapter_cache.json')  # set to None to disable the cache
+    lock = threading.Lock()
+
+    @staticmethod
+    def _load():
+
+        try:
+            with open(ProbeCache.path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save(entries):
+
+        try:
+            os.makedirs(os.path.dirname(ProbeCache.path), exist_ok=True)
+            with open(ProbeCache.path, 'w') as cache_file:
+                json.dump(entries, cache_file, indent=2)
+        except OSError as error:
+            warnings.warn(f'Unable to save adapter probe cache: {error}')
+
+    @staticmethod
+    def lookup(name, address):
+        """
+        Get the adapter that last connected to an instrument
+
+        :param name: (str) name of the instrument class
+        :param address: (str/int) address of the instrument
+        :return: (str) adapter class name, or None if there is no record
+        """
+
+        if ProbeCache.path is None:
+            return None
+
+        with ProbeCache.lock:
+            entry = ProbeCache._load().get(f'{name}@{address}', None)
+
+        if entry:
+            return entry['adapter']
+
+    @staticmethod
+    def record(name, address, adapter_name):
+        """
+        Record the adapter class that connected to an instrument
+
+        :param name: (str) name of the instrument class
+        :param address: (str/int) address of the instrument
+        :param adapter_name: (str) name of the adapter class
+        :return: None
+        """
+
+        if ProbeCache.path is None:
+            return
+
+        entry = {'adapter': adapter_name}
+
+        with ProbeCache.lock:
+            entries = ProbeCache._load()
+            if entries.get(f'{name}@{address}', None) != entry:
+                entries[f'{name}@{address}'] = entry
+                ProbeCache._save(entries)
+
+    @staticmethod
+    def forget(name, address):
+        """
+        Remove the record for an instrument, e.g. when the recorded adapter fails to connect
+
+        :param name: (str) name of the instrument class
+        :param address: (str/int) address of the instrument
+        :return: None
+        """
+
+        if ProbeCache.path is None:
+            return
+
+        with ProbeCache.lock:
+            entries = ProbeCache._load()
+            if entries.pop(f'{name}@{address}', None) is not None:
+                ProbeCache._save(entries)
+
+
+def parse_binary_block(read_bytes, dtype='f4', count=None, termination='\n'):
+    """
+    Parse an IEEE 488.2 binary block, of the form #<n><length><data> (definite length) or #0<data> (indefinite length)
+
+    :param read_bytes: (callable) function which reads exactly the given number of raw bytes from the instrument
+    :param dtype: (str/numpy.dtype) numpy data type of the block elements, including byte order
+    :param count: (int) number of elements; only needed for indefinite-length blocks
+    :param termination: (str) termination character(s) following the block, if any
+    :return: (numpy.ndarray) block data
+    """
+
+    dtype = np.dtype(dtype)
+
+    header = bytes(read_bytes(2))
+    if header[:1] != b'#' or not header[1:2].isdigit():
+        raise ValueError(f'invalid binary block header {header}')
+
+    digits = int(header[1:2])
+
+    if digits > 0:
+        length = int(bytes(read_bytes(digits)))
+    elif count is not None:
+        length = count * dtype.itemsize
+    else:
+        raise ValueError('reading an indefinite-length binary block requires the number of elements')
+
+    data = read_bytes(length)  # read in one go; np.frombuffer below wraps it without copying
+
+    if termination:
+        read_bytes(len(termination))
+
+    return np.frombuffer(data, dtype=dtype)
+
+
+buses = {}  # registry of all buses in use, of the form {..., key: bus, ...}
+buses_lock = threading.Lock()
+
+
+def get_bus(key):
+    """
+    Get the bus corresponding to a board, port or device, creating it if it is not registered yet
+
+    :param key: (hashable) identifier of the physical bus, e.g. 'GPIB0' or 'COM3'
+    :return: (Bus) the bus
+    """
+
+    with buses_lock:
+        if key not in buses:
+            buses[key] = Bus(key)
+
+        return buses[key]
+
+
 class Adapter:
     """
     Adapters connect instruments defined in an experiment to the appropriate communication backends.
@@ -71,6 +543,17 @@ class Adapter:
     max_repeats = 3
     max_reconnects = 1
 
+    connect_deadline = 10  # maximum time in seconds for an attempt to connect when probing adapters
+
+    call_deadline = 30  # maximum time in seconds for one read, query or write; if None, calls can block indefinitely
+    recovery_interval = 30  # minimum time in seconds between attempts to reconnect a suspect adapter
+
+    delay = 0  # time to wait before reconnecting, and for some adapters between a write and the following read
+
+    termination = '\n'  # termination character of responses, which also follows binary blocks
+
+    poll_interval = 0.01  # time between status polls when waiting for an operation to complete, in seconds
+
     kwargs = ['baud_rate', 'timeout', 'delay', 'byte_size', 'parity', 'stop_bits', 'close_port_after_each_call',
               'slave_mode', 'byte_order']
 
@@ -83,11 +566,19 @@ class Adapter:
         self.repeats = 0
         self.reconnects = 0
 
+        self.suspect = False  # whether a call has hung, in which case the backend is closed until it reconnects
+        self.suspect_since = None
+
+        self._worker = None  # runs the calls of this adapter that are held to a deadline
+
         for key, value in kwargs.items():
                 self.__setattr__(key, value)
 
         self.connect()
 
+        # Transactions on the same physical bus are serialized; those on separate buses can run in parallel
+        self.bus = get_bus(self.bus_key)
+
     def __del__(self):
         # Try to cleanly close communications when adapters are deleted
         if self.connected:
@@ -96,14 +587,96 @@ class Adapter:
             except BaseException:
                 pass
 
+        if self._worker is not None:
+            self._worker.stop()
+
     # All methods below should be overwritten in child class definitions
 
     def __repr__(self):
         return 'Adapter'
 
+    @property
+    def bus_key(self):
+        # the physical bus (board, port or device) used by this adapter; a generic adapter has a bus of its own
+        return f'{self}@{id(self)}'
+
+    @property
+    def worker(self):
+        # the worker thread is started on first use, and replaced after a call hangs on it
+
+        if self._worker is None or self._worker.retired:
+            self._worker = DeadlineWorker(name=f'{self.instrument} adapter')
+
+        return self._worker
+
+    @property
+    def nested(self):
+        # whether the current thread is the adapter's worker thread, running a call already held to a deadline
+        return self._worker is not None and self._worker.thread is threading.current_thread()
+
+    def call_with_deadline(self, function, deadline, *args, **kwargs):
+        """
+        Call a function on the adapter's worker thread, giving up on the adapter if the call hangs past the deadline
+
+        :param function: (callable) function to call
+        :param deadline: (float) maximum time to wait, in seconds; if None, the function is called directly
+        :param args: any arguments of the function
+        :param kwargs: any keyword arguments of the function
+        :return: return value of the function
+        """
+
+        try:
+            return run_with_deadline(function, deadline, args=args, kwargs=kwargs, bus=self.bus, worker=self.worker)
+        except DeadlineError as err:
+            self.abandon()
+            raise ConnectionError(f'{err}; the adapter of {self.instrument} is suspect until it reconnects')
+
+    def abandon(self):
+        """
+        Give up on the backend after a call hangs: mark the adapter as suspect and close the backend, which usually
+        ends the hung call
+
+        :return: None
+        """
+
+        self.suspect = True
+        self.suspect_since = time.time()
+
+        try:
+            run_with_deadline(self.disconnect, self.call_deadline, bus=self.bus, worker=self.worker)
+        except BaseException:
+            pass
+
+        self.connected = False
+
+    def recover(self):
+        """
+        Try to reconnect a suspect adapter, at most once per recovery interval
+
+        :return: None
+        """
+
+        if time.time() - self.suspect_since < self.recovery_interval:
+            raise ConnectionError(f'adapter of {self.instrument} is suspect after a hung call; '
+                                  f'reconnection will be attempted again later')
+
+        self.suspect_since = time.time()
+
+        try:
+            run_with_deadline(self.connect, self.connect_deadline, bus=self.bus, worker=self.worker)
+        except BaseException as error:
+            # the adapter stays suspect, and the next attempt waits for another recovery interval
+            self.connected = False
+            raise ConnectionError(f'failed to reconnect the suspect adapter of {self.instrument}: {error}') from error
+
+        self.suspect = False
+        self.repeats = 0
+        self.reconnects = 0
+
     def connect(self):
         self.connected = True
 
+    @bounded
     def write(self, message):
         pass
 
@@ -115,6 +688,65 @@ class Adapter:
     def query(self, question):
         pass
 
+    def _read_bytes(self, count):
+        # Read exactly count raw bytes; adapters that support binary transfers overwrite this method
+        raise NotImplementedError(f'{self} adapter does not support binary transfers')
+
+    def _read_block(self, dtype='f4', count=None):
+        # Read a binary block without the chaperone; adapters whose backends read blocks differently overwrite this
+        return parse_binary_block(self._read_bytes, dtype=dtype, count=count, termination=self.termination)
+
+    @chaperone
+    def read_binary_block(self, dtype='f4', count=None):
+        """
+        Read an IEEE 488.2 binary block from the instrument
+
+        :param dtype: (str/numpy.dtype) numpy data type of the block elements, including byte order
+        :param count: (int) number of elements; only needed for indefinite-length (#0) blocks
+        :return: (numpy.ndarray) block data
+        """
+
+        return self._read_block(dtype=dtype, count=count)
+
+    @chaperone
+    def query_binary(self, question, dtype='f4', count=None):
+        """
+        Query the instrument and read the response as an IEEE 488.2 binary block
+
+        :param question: (str) query to send
+        :param dtype: (str/numpy.dtype) numpy data type of the block elements, including byte order
+        :param count: (int) number of elements; only needed for indefinite-length (#0) blocks
+        :return: (numpy.ndarray) block data
+        """
+
+        # Write and read are retried together, so that a retry sends the question again
+        self.write(question)
+        return self._read_block(dtype=dtype, count=count)
+
+    def wait_for_completion(self, timeout=None):
+        """
+        Wait for the instrument to complete its pending operations, as indicated by the operation complete bit of its
+        standard event status register. This version polls the register; adapters whose backends can wait for service
+        requests overwrite this method.
+
+        :param timeout: (float) maximum waiting time in seconds; if None, wait indefinitely
+        :return: None
+        """
+
+        with self.bus.transaction(self.instrument.address):
+
+            self.query('*ESR?')  # clear any earlier events
+            self.write('*OPC')
+
+            start = time.time()
+            while not int(float(self.query('*ESR?'))) & 1:
+
+                if timeout is not None and time.time() - start > timeout:
+                    raise TimeoutError(f'operation of {self.instrument} did not complete within {timeout} seconds')
+
+                with self.bus.suspended():
+                    time.sleep(self.poll_interval)
+
     def disconnect(self):
         self.connected = False
 
@@ -131,6 +763,10 @@ class Serial(Adapter):
     def __repr__(self):
         return 'Serial'
 
+    @property
+    def bus_key(self):
+        return 'COM' + str(self.instrument.address)
+
     def connect(self):
 
         serial = importlib.import_module('serial')
@@ -140,6 +776,7 @@ class Serial(Adapter):
 
         self.connected = True
 
+    @bounded
     def write(self, message):
         self.backend.write(message)
 
@@ -154,6 +791,16 @@ class Serial(Adapter):
         time.sleep(self.delay)
         return self.backend.read()
 
+    def _read_bytes(self, count):
+
+        self.backend.timeout = self.timeout
+
+        data = self.backend.read(count)
+        if len(data) < count:
+            raise TimeoutError(f'read {len(data)} of {count} bytes before timing out')
+
+        return data
+
     def disconnect(self):
 
         self.backend.flushInput()
@@ -164,33 +811,168 @@ class Serial(Adapter):
 
 
 class VISA:
+    """
+    Common functionality of the VISA adapters; a single resource manager and a single listing of the available
+    resources are shared by all of them
+    """
 
-    @property
-    def timeout(self):
-        if self.connected:
-            return self.backend.timeout
-        else:
-            return None
+    manager = None  # process-wide pyvisa resource manager
+    resources = None  # cached tuple of available resource names; None if invalidated
+    gpib_index = {}  # cached resource names of the form {..., GPIB address: resource name, ...}
+    usb_index = {}  # cached resource names of the form {..., serial number: resource name, ...}
+    resources_lock = threading.Lock()
 
-    @timeout.setter
-    def timeout(self, timeout):
-        if self.connected:
-            self.backend.timeout = timeout
+    @staticmethod
+    def get_manager():
+        """
+        Get the shared pyvisa resource manager, creating it on first use
 
-    def write(self, message):
-        self.backend.write(message)
+        :return: (pyvisa.ResourceManager) the resource manager
+        """
 
-    @chaperone
-    def read(self):
-        self.backend.timeout = 1000 * self.timeout
-        return self.backend.read()
+        with VISA.resources_lock:
+            if VISA.manager is None:
+                visa = importlib.import_module('pyvisa')
+                VISA.manager = visa.ResourceManager()
 
-    @chaperone
-    def query(self, question):
+            return VISA.manager
+
+    @staticmethod
+    def list_resources(refresh=False):
+        """
+        List the available VISA resources, enumerating them only if there is no cached listing
+
+        :param refresh: (bool) whether to enumerate the resources even if there is a cached listing
+        :return: (tuple) resource names
+        """
+
+        manager = VISA.get_manager()
+
+        with VISA.resources_lock:
+            if VISA.resources is None or refresh:
+
+                resources = manager.list_resources()
+
+                gpib_index = {}
+                usb_index = {}
+                for resource in resources:
+
+                    gpib_match = re.match('GPIB[0-9]+::([0-9]+)::INSTR', resource)
+                    if gpib_match:
+                        gpib_index[gpib_match.group(1)] = resource
+
+                    usb_match = re.match('USB[0-9]*::[^:]+::[^:]+::([^:]+)::', resource)
+                    if usb_match:
+                        usb_index[usb_match.group(1)] = resource
+
+                VISA.resources = resources
+                VISA.gpib_index = gpib_index
+                VISA.usb_index = usb_index
+
+            return VISA.resources
+
+    @staticmethod
+    def invalidate_resources():
+        """
+        Discard the cached resource listing, so that the next lookup enumerates the resources again
+        """
+
+        with VISA.resources_lock:
+            VISA.resources = None
+
+    @staticmethod
+    def find_resource(index, key):
+        """
+        Look up a resource name in one of the cached indices, enumerating the resources again only if it is not found
+
+        :param index: (str) either 'gpib' (keyed by GPIB address) or 'usb' (keyed by serial number)
+        :param key: (str/int) GPIB address or serial number of the device
+        :return: (str) resource name, or None if the device is not found
+        """
+
+        key = str(key)
+
+        for refresh in [False, True]:
+
+            VISA.list_resources(refresh=refresh)
+
+            resource = {'gpib': VISA.gpib_index, 'usb': VISA.usb_index}[index].get(key, None)
+
+            if resource is None and index == 'usb':
+                # serial numbers not in the standard position of the resource name
+                resource = next((name for name in VISA.resources if key in name), None)
+
+            if resource:
+                return resource
+
+        return None
+
+    @property
+    def timeout(self):
+        if self.connected:
+            return self.backend.timeout
+        else:
+            return None
+
+    @timeout.setter
+    def timeout(self, timeout):
+        if self.connected:
+            self.backend.timeout = timeout
+
+    @bounded
+    def write(self, message):
+        self.backend.write(message)
+
+    @chaperone
+    def read(self):
+        self.backend.timeout = 1000 * self.timeout
+        return self.backend.read()
+
+    @chaperone
+    def query(self, question):
         self.backend.write(question)
         time.sleep(self.delay)
         return self.backend.read()
 
+    def _read_bytes(self, count):
+        return self.backend.read_bytes(count, break_on_termchar=False)
+
+    def wait_for_completion(self, timeout=None):
+        # The operation complete event is made to request service, and the backend waits for the request
+
+        constants = importlib.import_module('pyvisa.constants')
+        service_request = constants.EventType.service_request
+
+        with self.bus.transaction(self.instrument.address):
+
+            self.query('*ESR?')  # clear any earlier events
+            self.write('*ESE 1')  # operation complete sets the event status bit of the status byte...
+            self.write('*SRE 32')  # ... which requests service
+
+            self.backend.enable_event(service_request, constants.EventMechanism.queue)
+
+            try:
+                self.write('*OPC')
+
+                if timeout is None:
+                    visa_timeout = constants.VI_TMO_INFINITE
+                else:
+                    visa_timeout = int(1000 * timeout)
+
+                with self.bus.suspended():
+                    response = self.backend.wait_on_event(service_request, visa_timeout, capture_timeout=True)
+
+            finally:
+                self.backend.disable_event(service_request, constants.EventMechanism.queue)
+                self.backend.discard_events(service_request, constants.EventMechanism.queue)
+
+            self.backend.read_stb()  # clears the service request
+            self.query('*ESR?')
+            self.write('*SRE 0')
+
+            if response.timed_out:
+                raise TimeoutError(f'operation of {self.instrument} did not complete within {timeout} seconds')
+
     def disconnect(self):
         self.backend.clear()
         self.backend.close()
@@ -209,10 +991,13 @@ class VISASerial(VISA, Adapter):
     def __repr__(self):
         return 'VISASerial'
 
+    @property
+    def bus_key(self):
+        return 'COM' + str(self.instrument.address)
+
     def connect(self):
 
-        visa = importlib.import_module('pyvisa')
-        manager = visa.ResourceManager()
+        manager = VISA.get_manager()
 
         self.backend = manager.open_resource(f"ASRL{self.instrument.address}::INSTR",
                                              open_timeout=self.timeout,
@@ -220,6 +1005,8 @@ class VISASerial(VISA, Adapter):
 
         self.connected = True
 
+    wait_for_completion = Adapter.wait_for_completion  # serial instruments cannot request service
+
 
 class VISAGPIB(VISA, Adapter):
     """
@@ -229,20 +1016,21 @@ class VISAGPIB(VISA, Adapter):
     def __repr__(self):
         return 'VISAGPIB'
 
+    @property
+    def bus_key(self):
+        return self.board
+
     def connect(self):
 
-        visa = importlib.import_module('pyvisa')
-        manager = visa.ResourceManager()
+        manager = VISA.get_manager()
 
-        full_address = None
-        for address in manager.list_resources():
-            if re.match('GPIB[0-9]::'+str(self.instrument.address)+'::INSTR', address):
-                full_address = address
+        full_address = VISA.find_resource('gpib', self.instrument.address)
 
         if full_address:
             self.backend = manager.open_resource(full_address, open_timeout=self.timeout)
+            self.board = full_address.split('::')[0]  # e.g. GPIB0
         else:
-            ConnectionError(f'GPIB device at address {self.instrument.address} not found!')
+            raise ConnectionError(f'GPIB device at address {self.instrument.address} not found!')
 
         self.connected = True
 
@@ -255,18 +1043,22 @@ class VISAUSB(VISA, Adapter):
     def __repr__(self):
         return 'VISAUSB'
 
+    @property
+    def bus_key(self):
+        return 'USB::' + str(self.instrument.address)
+
     def connect(self):
 
-        visa = importlib.import_module('pyvisa')
-        manager = visa.ResourceManager()
+        manager = VISA.get_manager()
 
-        serial_number = str(self.instrument.address)
+        address = VISA.find_resource('usb', self.instrument.address)
 
-        for address in manager.list_resources():
-            if serial_number in address:
-                self.backend = manager.open_resource(address,
-                                                     open_timeout=self.timeout)
-                self.backend.timeout = self.timeout
+        if address:
+            self.backend = manager.open_resource(address,
+                                                 open_timeout=self.timeout)
+            self.backend.timeout = self.timeout
+        else:
+            raise ConnectionError(f'USB device with serial number {self.instrument.address} not found!')
 
         self.connected = True
 
@@ -315,6 +1107,10 @@ class LinuxGPIB(Adapter):
     def __repr__(self):
         return 'LinuxGPIB'
 
+    @property
+    def bus_key(self):
+        return 'GPIB0'  # the board index used in connect below
+
     def connect(self):
 
         self.backend = importlib.import_module('gpib')
@@ -328,26 +1124,77 @@ class LinuxGPIB(Adapter):
         if new_timeout is None:
             self.backend.timeout(self.descr, 0)
         else:
-            for index, timeout in self.timeouts.items()[1:]:
+            for index, timeout in list(self.timeouts.items())[1:]:
                 if timeout >= new_timeout:
                     self.backend.timeout(self.descr, index)
                     break
 
         self._timeout = new_timeout
 
+    @bounded
     def write(self, message):
         self.backend.write(self.descr, message)
 
+    def _read_message(self, read_length=512):
+        # Read in chunks of read_length bytes until the instrument asserts EOI, so long responses are not truncated
+
+        message = bytearray()
+        while True:
+            message += self.backend.read(self.descr, read_length)
+
+            if self.backend.ibsta() & 0x2000:  # END bit of the status word
+                return bytes(message)
+
+    def _read_bytes(self, count):
+
+        data = bytearray()
+        while len(data) < count:
+            data += self.backend.read(self.descr, count - len(data))
+
+        return data
+
     @chaperone
     def read(self, read_length=512):
         self.set_timeout(self.timeout)
-        return self.backend.read(self.descr, read_length).decode()
+        return self._read_message(read_length).decode()
 
     @chaperone
     def query(self, question):
-        self.backend.write(question)
+        self.write(question)
         time.sleep(self.delay)
-        return self.backend.read()
+        self.set_timeout(self.timeout)
+        return self._read_message().decode()
+
+    def _read_block(self, dtype='f4', count=None):
+        self.set_timeout(self.timeout)
+        return parse_binary_block(self._read_bytes, dtype=dtype, count=count, termination=self.termination)
+
+    def wait_for_completion(self, timeout=None):
+        # The operation complete event is made to request service, and ibwait returns on the request or the timeout;
+        # the bus is kept, since the board is not used by other threads while waiting
+
+        with self.bus.transaction(self.instrument.address):
+
+            self.query('*ESR?')  # clear any earlier events
+            self.write('*ESE 1')  # operation complete sets the event status bit of the status byte...
+            self.write('*SRE 32')  # ... which requests service
+            self.write('*OPC')
+
+            previous_timeout = self.timeout
+
+            try:
+                self.set_timeout(timeout)
+                self.backend.wait(self.descr, 0x4800)  # RQS or TIMO bits of the status word
+                status = self.backend.ibsta()
+            finally:
+                self.set_timeout(previous_timeout)
+
+            self.backend.serial_poll(self.descr)  # clears the service request
+            self.query('*ESR?')
+            self.write('*SRE 0')
+
+            if not status & 0x800:
+                raise TimeoutError(f'operation of {self.instrument} did not complete within {timeout} seconds')
 
     def disconnect(self):
         self.backend.clear(self.descr)
@@ -372,6 +1219,7 @@ class PrologixGPIBUSB:
     def __init__(self):
 
         self.devices = []
+        self.address = None  # GPIB address of the currently addressed device
 
         serial = importlib.import_module('serial')
         list_ports = importlib.import_module('serial.tools.list_ports')
@@ -387,38 +1235,72 @@ class PrologixGPIBUSB:
         else:
             raise ConnectionError(f'Prologix GPIB-USB adapter not found!')
 
+        # All instruments on this controller share its serial port
+        self.port = port
+        self.bus = get_bus(port)
+
         self.write('rst', to_controller=True)
         print('Resetting Prologix GPIB-USB controller...')
         time.sleep(6)  # controller
         self.write('mode 1', to_controller=True)
         self.write('auto 0', to_controller=True)
 
+    def select(self, address):
+        """
+        Address a GPIB device, if it is not already addressed
+
+        :param address: (int) GPIB address of the device
+        :return: None
+        """
+
+        if address not in self.devices:
+            raise AttributeError(f"GPIB device at address {address} is not connected!")
+
+        if address != self.address:
+            self.write(f'addr {address}', to_controller=True)
+            self.address = address
+
     def write(self, message, to_controller=False, address=None):
 
-        if address:
-            if address in self.devices:
-                self.write(f'addr {address}', to_controller=True)
-            else:
-                raise AttributeError(f"GPIB device at address {address} is not connected!")
+        with self.bus.transaction(address):
+
+            if address is not None:
+                self.select(address)
 
-        proper_message = message.encode() + b'\r'
+            proper_message = message.encode() + b'\r'
 
-        if to_controller:
-            proper_message = b'++' + proper_message
+            if to_controller:
+                proper_message = b'++' + proper_message
 
-        self.serial_port.write(proper_message)
+                if message == 'rst':
+                    self.address = None
+
+            self.serial_port.write(proper_message)
 
     def read(self, address=None):
 
-        if address:
-            if address in self.devices:
-                self.write(f'addr {address}', to_controller=True)
-            else:
-                raise AttributeError(f"GPIB device at address {address} is not connected!")
+        with self.bus.transaction(address):
+
+            if address is not None:
+                self.select(address)
 
-        self.write('read eoi', to_controller=True)
+            self.write('read eoi', to_controller=True)
 
-        return self.serial_port.read_until().decode().strip()
+            return self.serial_port.read_until().decode().strip()
+
+    def read_bytes(self, count):
+        """
+        Read exactly count raw bytes from the serial port; the device must already have been told to talk
+
+        :param count: (int) number of bytes to read
+        :return: (bytes) data
+        """
+
+        data = self.serial_port.read(count)
+        if len(data) < count:
+            raise TimeoutError(f'read {len(data)} of {count} bytes before timing out')
+
+        return data
 
     def close(self):
         self.serial_port.close()
@@ -430,14 +1312,20 @@ class PrologixGPIB(Adapter):
     """
 
     delay = 0.2
+    connect_deadline = 20  # the controller takes several seconds to reset
 
     # A single Prologix GPIB-USB adapter can address several GPIB instruments,
     # but only one reference to the controller's serial port can exist
     controller = None
+    controller_lock = threading.Lock()
 
     def __repr__(self):
         return 'PrologixGPIB'
 
+    @property
+    def bus_key(self):
+        return self.backend.port
+
     @property
     def timeout(self):
         if self.connected:
@@ -452,38 +1340,56 @@ class PrologixGPIB(Adapter):
 
     def connect(self):
 
-        if not PrologixGPIB.controller:
-            PrologixGPIB.controller = PrologixGPIBUSB()
+        with PrologixGPIB.controller_lock:
+
+            if not PrologixGPIB.controller:
+                PrologixGPIB.controller = PrologixGPIBUSB()
 
-        PrologixGPIB.controller.devices.append(self.instrument.address)
+            PrologixGPIB.controller.devices.append(self.instrument.address)
 
         self.backend = PrologixGPIB.controller
 
         self.connected = True
 
+    @bounded
     def write(self, message):
         self.backend.write(message, address=self.instrument.address)
 
     @chaperone
     def read(self):
-        self.backend.timeout = self.timeout
-        return self.backend.read(address=self.instrument.address)
+        with self.backend.bus.transaction(self.instrument.address):
+            self.backend.timeout = self.timeout
+            return self.backend.read(address=self.instrument.address)
 
     @chaperone
     def query(self, question):
-        self.backend.write(question, address=self.instrument.address)
-        time.sleep(self.delay)
-        return self.backend.read(address=self.instrument.address)
+        # write and read in one transaction, so that no other device can be addressed in between
+        with self.backend.bus.transaction(self.instrument.address):
+            self.backend.write(question, address=self.instrument.address)
+            time.sleep(self.delay)
+            return self.backend.read(address=self.instrument.address)
+
+    def _read_block(self, dtype='f4', count=None):
+        with self.backend.bus.transaction(self.instrument.address):
+            self.backend.timeout = self.timeout
+            self.backend.select(self.instrument.address)
+            self.backend.write('read eoi', to_controller=True)
+
+            return parse_binary_block(self.backend.read_bytes, dtype=dtype, count=count, termination=self.termination)
 
     def disconnect(self):
-        self.backend.write('clr', to_controller=True, address=self.instrument.address)  # clear the instrument buffers
-        self.backend.write('loc', to_controller=True)  # return instrument to local control
 
-        self.backend.devices.remove(self.instrument.address)
+        with self.backend.bus.transaction(self.instrument.address):
+            self.backend.write('clr', to_controller=True, address=self.instrument.address)  # clear the instrument buffers
+            self.backend.write('loc', to_controller=True)  # return instrument to local control
+
+        with PrologixGPIB.controller_lock:
 
-        if len(self.backend.devices) == 0:
-            self.backend.close()
-            PrologixGPIB.controller = None
+            self.backend.devices.remove(self.instrument.address)
+
+            if len(self.backend.devices) == 0:
+                self.backend.close()
+                PrologixGPIB.controller = None
 
         self.connected = False
 
@@ -496,12 +1402,34 @@ class USBTMC(Adapter):
     def __repr__(self):
         return 'USBTMC'
 
+    @property
+    def bus_key(self):
+        return 'USB::' + str(self.instrument.address)
+
     def connect(self):
         usbtmc = importlib.import_module('usbtmc')
         self.backend = usbtmc.Instrument('USB::'+self.instrument.address+'::INSTR')
 
+        self.buffer = bytearray()  # raw bytes received but not yet read
+
         self.connected = True
 
+    def _read_bytes(self, count):
+        # USBTMC transfers whole messages, so keep any bytes beyond those requested for the next read
+
+        while len(self.buffer) < count:
+            self.buffer += self.backend.read_raw()
+
+        data = self.buffer[:count]
+        del self.buffer[:count]
+
+        return data
+
+    def _read_block(self, dtype='f4', count=None):
+        self.buffer = bytearray()
+        return parse_binary_block(self._read_bytes, dtype=dtype, count=count, termination=self.termination)
+
+    @bounded
     def write(self, message):
         self.backend.write(message)
 
@@ -520,6 +1448,250 @@ class USBTMC(Adapter):
         self.connected = False
 
 
+class SocketSCPI(Adapter):
+    """
+    Handles communications with SCPI instruments over raw TCP sockets (LXI port 5025), with addresses of the form
+    'host' or 'host:port'
+    """
+
+    timeout = 1
+    delay = 0
+    chunk_size = 65536  # maximum number of bytes received at once
+
+    def __repr__(self):
+        return 'SocketSCPI'
+
+    @property
+    def host_and_port(self):
+
+        address = str(self.instrument.address)
+
+        if ':' in address:
+            host, port = address.split(':')
+            return host, int(port)
+        else:
+            return address, 5025
+
+    @property
+    def bus_key(self):
+        return 'TCPIP::%s:%d' % self.host_and_port
+
+    def connect(self):
+
+        self.backend = socket.create_connection(self.host_and_port, timeout=self.timeout)
+        self.backend.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # send short commands immediately
+
+        self.buffer = bytearray()  # bytes received but not yet read
+
+        self.connected = True
+
+    @bounded
+    def write(self, message):
+        self.backend.sendall(message.encode() + self.termination.encode())
+
+    def _read_line(self):
+
+        self.backend.settimeout(self.timeout)
+
+        terminator = self.termination.encode()
+
+        end = self.buffer.find(terminator)
+        while end < 0:
+            chunk = self.backend.recv(self.chunk_size)
+            if not chunk:
+                raise ConnectionError(f'connection to {self.instrument.address} was closed!')
+
+            self.buffer += chunk
+            end = self.buffer.find(terminator, max(len(self.buffer) - len(chunk) - len(terminator), 0))
+
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end + len(terminator)]
+
+        return line.decode()
+
+    def _read_bytes(self, count):
+        # Read exactly count bytes directly into a preallocated buffer
+
+        self.backend.settimeout(self.timeout)
+
+        data = bytearray(count)
+        view = memoryview(data)
+
+        received = min(len(self.buffer), count)
+        view[:received] = self.buffer[:received]
+        del self.buffer[:received]
+
+        while received < count:
+            n = self.backend.recv_into(view[received:], min(count - received, self.chunk_size))
+            if n == 0:
+                raise ConnectionError(f'connection to {self.instrument.address} was closed!')
+            received += n
+
+        return data
+
+    @chaperone
+    def read(self):
+        return self._read_line()
+
+    @chaperone
+    def query(self, question):
+        self.write(question)
+        return self._read_line()
+
+    @chaperone
+    def query_many(self, questions, pipeline=True):
+        """
+        Send several queries and read all of their responses
+
+        :param questions: (list) queries to send
+        :param pipeline: (bool) whether to send all of the queries before reading any of the responses
+        :return: (list) responses, in the order of the queries
+        """
+
+        if pipeline:
+            terminator = self.termination.encode()
+            self.backend.sendall(b''.join(question.encode() + terminator for question in questions))
+            return [self._read_line() for _ in questions]
+        else:
+            responses = []
+            for question in questions:
+                self.write(question)
+                responses.append(self._read_line())
+            return responses
+
+    def disconnect(self):
+
+        self.backend.close()
+        self.connected = False
+
+
+# Numpy type and number of 16-bit registers for each register data type
+register_types = {
+    'uint16': ('u2', 1),
+    'int16': ('i2', 1),
+    'uint32': ('u4', 2),
+    'int32': ('i4', 2),
+    'float': ('f4', 2),
+}
+
+
+def register_spec(spec):
+    """
+    Complete a register map entry with the default type, scale and byte order
+
+    :param spec: (int/tuple) register address, or tuple of the form (address[, type[, scale[, byte_order]]])
+    :return: (tuple) register specification of the form (address, type, scale, byte_order)
+    """
+
+    if isinstance(spec, int):
+        spec = (spec,)
+
+    return tuple(spec) + (None, 'uint16', 1, 0)[len(spec):]
+
+
+def decode_registers(registers, type='uint16', byte_order=0):
+    """
+    Decode raw 16-bit register values
+
+    :param registers: (array-like) raw register values
+    :param type: (str) register data type; one of the keys of register_types
+    :param byte_order: (int) byte order of multi-register values, numbered as in minimalmodbus:
+                       0 = ABCD, 1 = DCBA, 2 = BADC, 3 = CDAB
+    :return: (numpy.ndarray) decoded values
+    """
+
+    dtype, size = register_types[type]
+
+    if byte_order == 1:
+        return np.frombuffer(np.asarray(registers, dtype='>u2').tobytes(), dtype='<' + dtype)
+    elif byte_order == 2:
+        return np.frombuffer(np.asarray(registers, dtype='<u2').tobytes(), dtype='>' + dtype)
+    elif byte_order == 3:
+        words = np.asarray(registers, dtype='>u2').reshape(-1, size)[:, ::-1]
+        return np.frombuffer(words.tobytes(), dtype='>' + dtype)
+    else:
+        return np.frombuffer(np.asarray(registers, dtype='>u2').tobytes(), dtype='>' + dtype)
+
+
+def encode_registers(values, type='uint16', byte_order=0):
+    """
+    Encode values as raw 16-bit register values; inverse of decode_registers
+
+    :param values: (float/int/array-like) values to encode
+    :param type: (str) register data type; one of the keys of register_types
+    :param byte_order: (int) byte order of multi-register values, numbered as in minimalmodbus
+    :return: (list) raw register values
+    """
+
+    dtype, size = register_types[type]
+
+    if byte_order == 1:
+        data = np.asarray(values, dtype='<' + dtype).reshape(-1).tobytes()
+        words = np.frombuffer(data, dtype='>u2')
+    elif byte_order == 2:
+        data = np.asarray(values, dtype='>' + dtype).reshape(-1).tobytes()
+        words = np.frombuffer(data, dtype='<u2')
+    elif byte_order == 3:
+        data = np.asarray(values, dtype='>' + dtype).reshape(-1).tobytes()
+        words = np.frombuffer(data, dtype='>u2').reshape(-1, size)[:, ::-1]
+    else:
+        data = np.asarray(values, dtype='>' + dtype).reshape(-1).tobytes()
+        words = np.frombuffer(data, dtype='>u2')
+
+    return [int(word) for word in words.reshape(-1)]
+
+
+def plan_register_blocks(register_map, max_block=125, max_gap=8):
+    """
+    Group the registers of a register map into contiguous blocks that can each be read in one transaction
+
+    :param register_map: (dict) registers of the form {..., name: (address, type, scale, byte_order), ...}
+    :param max_block: (int) maximum number of registers in one block
+    :param max_gap: (int) maximum number of unused registers read to join two blocks
+    :return: (list) blocks of the form [..., (start, count, [..., (name, spec), ...]), ...]
+    """
+
+    entries = sorted(((name, register_spec(spec)) for name, spec in register_map.items()), key=lambda x: x[1][0])
+
+    blocks = []
+    for name, spec in entries:
+
+        address, type = spec[0], spec[1]
+        end = address + register_types[type][1]
+
+        if blocks:
+            start, count, members = blocks[-1]
+            if address - (start + count) <= max_gap and end - start <= max_block:
+                blocks[-1] = (start, max(count, end - start), members + [(name, spec)])
+                continue
+
+        blocks.append((address, end - address, [(name, spec)]))
+
+    return blocks
+
+
+def unpack_register_blocks(blocks, block_registers):
+    """
+    Decode and scale the values of a register map from the raw registers of its blocks
+
+    :param blocks: (list) blocks as returned by plan_register_blocks
+    :param block_registers: (list) raw register values read for each block
+    :return: (dict) values of the form {..., name: value, ...}
+    """
+
+    values = {}
+    for (start, count, members), registers in zip(blocks, block_registers):
+
+        registers = np.asarray(registers, dtype='u2')
+
+        for name, (address, type, scale, byte_order) in members:
+            size = register_types[type][1]
+            raw = decode_registers(registers[address - start:address - start + size], type, byte_order)[0]
+            values[name] = raw.item() * scale
+
+    return values
+
+
 class Modbus(Adapter):
     """
     Handles communications with modbus serial instruments through the Minimal Modbus package
@@ -533,10 +1705,23 @@ class Modbus(Adapter):
     stop_bits = 1
     parity = 'N'
     delay = 0.05
+    close_port_after_each_call = False
+
+    # All slaves on the same serial port (e.g. an RS-485 line) share one persistently open port,
+    # of the form {..., port: [serial port, number of connected adapters], ...}
+    ports = {}
+    ports_lock = threading.Lock()
+
+    max_block = 125  # maximum number of registers in one read
+    max_gap = 8  # maximum number of unused registers read in order to join two blocks of registers
 
     def __repr__(self):
         return 'Modbus'
 
+    @property
+    def bus_key(self):
+        return self.instrument.address.split('::')[0]  # instruments on the same serial port share the bus
+
     def connect(self):
 
         minimal_modbus = importlib.import_module('minimalmodbus')
@@ -545,24 +1730,36 @@ class Modbus(Adapter):
         # Get port and channel
         port, channel = self.instrument.address.split('::')
 
-        # Handshake with instrument
-        self.backend = minimal_modbus.Instrument(port, int(channel), mode=self.slave_mode)
-        self.backend.serial.baudrate = self.baud_rate
-        self.backend.serial.timeout = self.timeout
-        self.backend.serial.bytesize = self.byte_size
-        self.backend.serial.parity = self.parity
-        self.backend.serial.stopbits = self.stop_bits
-        self.backend.close_port_after_each_call = True
-        time.sleep(self.delay)
+        with Modbus.ports_lock:
+
+            if port in Modbus.ports:
+                Modbus.ports[port][1] += 1
+            else:
+                Modbus.ports[port] = [serial.Serial(port=port), 1]
+
+            serial_port = Modbus.ports[port][0]
+
+            serial_port.baudrate = self.baud_rate
+            serial_port.timeout = self.timeout
+            serial_port.bytesize = self.byte_size
+            serial_port.parity = self.parity
+            serial_port.stopbits = self.stop_bits
+
+            if not serial_port.is_open:
+                serial_port.open()
+
+        # Handshake with instrument; minimalmodbus observes the silent interval between frames, so no fixed delay
+        self.backend = minimal_modbus.Instrument(serial_port, int(channel), mode=self.slave_mode,
+                                                 close_port_after_each_call=self.close_port_after_each_call)
 
         self.connected = True
 
+    @bounded
     def write(self, register, message, type='uint16', byte_order=0):
         if type == 'uint16':
             self.backend.write_register(register, message)
-        elif type == 'float':
-            self.backend.write_float(register, message, byteorder=byte_order)
-        time.sleep(self.delay)
+        else:
+            self.backend.write_registers(register, encode_registers(message, type, byte_order))
 
     @chaperone
     def read(self, register, type='uint16', byte_order=0):
@@ -572,21 +1769,302 @@ class Modbus(Adapter):
             return self.backend.read_register(register)
         elif type == 'float':
             return self.backend.read_float(register, byteorder=byte_order)
+        else:
+            count = register_types[type][1]
+            return decode_registers(self.backend.read_registers(register, count), type, byte_order)[0].item()
+
+    @chaperone
+    def read_map(self, register_map):
+        """
+        Read several registers, coalesced into as few contiguous block reads as possible
+
+        :param register_map: (dict) registers of the form {..., name: (address, type, scale, byte_order), ...}
+        :return: (dict) scaled values of the form {..., name: value, ...}
+        """
+
+        self.backend.serial.timeout = self.timeout
+
+        blocks = plan_register_blocks(register_map, max_block=self.max_block, max_gap=self.max_gap)
+
+        block_registers = [self.backend.read_registers(start, count) for start, count, _ in blocks]
+
+        return unpack_register_blocks(blocks, block_registers)
+
+    def disconnect(self):
+
+        port = self.instrument.address.split('::')[0]
+
+        # close the shared port when the last slave on it is disconnected
+        with Modbus.ports_lock:
+            if port in Modbus.ports:
+                Modbus.ports[port][1] -= 1
+
+                if Modbus.ports[port][1] <= 0:
+                    Modbus.ports.pop(port)[0].close()
+
+        self.connected = False
+
+
+class ModbusError(ValueError):
+    """
+    Raised when a Modbus device answers a request with an exception response; unlike socket errors, this leaves the
+    connection usable
+    """
+
+    def __init__(self, function, code):
+
+        self.function = function  # function code of the request
+        self.code = code  # Modbus exception code
+
+        ValueError.__init__(self, f'Modbus exception code {code} for function code {function}')
+
+
+class ModbusTCPGateway:
+    """
+    Wraps a persistent socket connection to a Modbus TCP server or gateway; requests are framed with transaction IDs so
+    that several of them can be outstanding at once
+    """
+
+    @property
+    def timeout(self):
+        return self.socket.gettimeout()
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.socket.settimeout(timeout)
+
+    def __init__(self, host, port=502, timeout=1):
+
+        self.host = host
+        self.port = port
+        self.devices = []
+        self.broken = False  # set when the connection fails, so that it is replaced upon reconnection
+        self.transaction_id = 0
+        self.responses = {}  # responses received ahead of the ones being waited for
+
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, unit, pdu):
+        """
+        Send a request without waiting for the response
+
+        :param unit: (int) unit identifier (slave ID) of the device
+        :param pdu: (bytes) protocol data unit, i.e. function code and data
+        :return: (int) transaction ID of the request
+        """
+
+        self.transaction_id = (self.transaction_id + 1) % 0x10000
+
+        header = struct.pack('>HHHB', self.transaction_id, 0, len(pdu) + 1, unit)
+        self.socket.sendall(header + pdu)
+
+        return self.transaction_id
+
+    def _receive_exactly(self, count):
+
+        data = bytearray()
+        while len(data) < count:
+            chunk = self.socket.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError(f'Modbus TCP connection to {self.host}:{self.port} was closed!')
+            data += chunk
+
+        return bytes(data)
+
+    def receive(self, transaction_id):
+        """
+        Wait for the response to a request
+
+        :param transaction_id: (int) transaction ID of the request
+        :return: (bytes) protocol data unit of the response
+        """
+
+        while transaction_id not in self.responses:
+            received_id, _, length, _ = struct.unpack('>HHHB', self._receive_exactly(7))
+            self.responses[received_id] = self._receive_exactly(length - 1)
+
+        pdu = self.responses.pop(transaction_id)
+
+        if pdu[0] & 0x80:
+            raise ModbusError(pdu[0] & 0x7f, pdu[1])
+
+        return pdu
+
+    def request(self, unit, pdu, timeout=None):
+        return self.pipeline(unit, [pdu], timeout=timeout)[0]
+
+    def pipeline(self, unit, pdus, timeout=None):
+        """
+        Send several requests back to back, then collect all of the responses
+
+        :param unit: (int) unit identifier (slave ID) of the device
+        :param pdus: (list) protocol data units of the requests
+        :param timeout: (float) socket timeout in seconds; if None, the current timeout is kept
+        :return: (list) protocol data units of the responses, in the order of the requests
+        """
+
+        try:
+            if timeout is not None:
+                self.timeout = timeout
+
+            transaction_ids = [self.send(unit, pdu) for pdu in pdus]
+
+            # collect every response before reporting an exception response, so that none are left on the socket
+            responses = []
+            error = None
+            for transaction_id in transaction_ids:
+                try:
+                    responses.append(self.receive(transaction_id))
+                except ModbusError as exception:
+                    error = error or exception
+
+            if error:
+                raise error
+
+            return responses
+        except OSError:  # only socket errors break the connection
+            self.broken = True
+            raise
+        finally:
+            self.responses = {}  # unclaimed responses are stale
+
+    def close(self):
+        self.socket.close()
+
+
+class ModbusTCP(Adapter):
+    """
+    Handles communications with Modbus TCP instruments, with addresses of the form 'host::unit' or 'host:port::unit'
+
+    Register maps are read in contiguous blocks as with the Modbus (RTU) adapter, with all block requests pipelined.
+    """
+
+    timeout = 1
+    delay = 0
+
+    max_block = 125  # maximum number of registers in one read
+    max_gap = 8  # maximum number of unused registers read in order to join two blocks of registers
+
+    # A single connection to each gateway is shared by all of the devices behind it
+    gateways = {}
+    gateways_lock = threading.Lock()
+
+    def __repr__(self):
+        return 'ModbusTCP'
+
+    @property
+    def gateway_address(self):
+
+        host = self.instrument.address.split('::')[0]
+
+        if ':' in host:
+            host, port = host.split(':')
+            return host, int(port)
+        else:
+            return host, 502
+
+    @property
+    def bus_key(self):
+        return 'ModbusTCP::%s:%d' % self.gateway_address
+
+    def connect(self):
+
+        host, port = self.gateway_address
+        self.unit = int(self.instrument.address.split('::')[1])
+
+        with ModbusTCP.gateways_lock:
+
+            gateway = ModbusTCP.gateways.get((host, port), None)
+
+            if gateway is None or gateway.broken:
+                ModbusTCP.gateways[(host, port)] = ModbusTCPGateway(host, port, timeout=self.timeout)
+
+                if gateway:
+                    gateway.close()
+                    ModbusTCP.gateways[(host, port)].devices = gateway.devices
+
+            self.backend = ModbusTCP.gateways[(host, port)]
+            self.backend.devices.append(self.unit)
+
+        self.connected = True
+
+    @bounded
+    def write(self, register, message, type='uint16', byte_order=0):
+
+        if type == 'uint16':
+            self.backend.request(self.unit, struct.pack('>BHH', 6, register, int(message)))
+        else:
+            words = encode_registers(message, type, byte_order)
+            pdu = struct.pack('>BHHB', 16, register, len(words), 2 * len(words))
+            self.backend.request(self.unit, pdu + struct.pack('>%dH' % len(words), *words))
+
+    @chaperone
+    def read(self, register, type='uint16', byte_order=0):
+        block = (register, register_types[type][1], [('value', (register, type, 1, byte_order))])
+        return self._read_blocks([block])['value']
+
+    @chaperone
+    def read_map(self, register_map):
+        """
+        Read several registers, coalesced into as few contiguous blocks as possible, with all block reads pipelined
+
+        :param register_map: (dict) registers of the form {..., name: (address, type, scale, byte_order), ...}
+        :return: (dict) scaled values of the form {..., name: value, ...}
+        """
+
+        return self._read_blocks(plan_register_blocks(register_map, max_block=self.max_block, max_gap=self.max_gap))
+
+    def _read_blocks(self, blocks):
+
+        responses = self.backend.pipeline(self.unit, [struct.pack('>BHH', 3, start, count)
+                                                      for start, count, _ in blocks], timeout=self.timeout)
+
+        # each response is the function code, the byte count and the register values
+        block_registers = [np.frombuffer(response, dtype='>u2', offset=2) for response in responses]
+
+        return unpack_register_blocks(blocks, block_registers)
 
     def disconnect(self):
-        if not self.close_port_after_each_call:
-            self.backend.serial.close()
+
+        with ModbusTCP.gateways_lock:
+
+            gateway = ModbusTCP.gateways.get((self.backend.host, self.backend.port), self.backend)
+
+            gateway.devices.remove(self.unit)
+
+            if len(gateway.devices) == 0:
+                gateway.close()
+                ModbusTCP.gateways.pop((gateway.host, gateway.port), None)
+
         self.connected = False
 
 
 class Phidget(Adapter):
+    """
+    Handles communications with Phidgets devices through the Phidget22 library
+
+    Parameters can be watched, in which case the device reports new values at its data interval through change
+    handlers, and reading them is just a lookup of the latest value, with no USB round trip.
+    """
 
     delay = 0.2
     timeout = 5
 
+    buffer_size = 10000  # number of values kept for each watched parameter
+
+    # Adapters for the same channel share one open channel and its watched values,
+    # of the form {..., address: [channel, number of connected adapters, latest values, buffers], ...}
+    channels = {}
+    channels_lock = threading.Lock()
+
     def __repr__(self):
         return 'Phidget'
 
+    @property
+    def bus_key(self):
+        return 'Phidget::' + str(self.instrument.address).split('::')[0]  # devices are identified by serial number
+
     def connect(self):
 
         address_parts = self.instrument.address.split('::')
@@ -596,33 +2074,109 @@ class Phidget(Adapter):
 
         self.PhidgetException = importlib.import_module("Phidget22.PhidgetException").PhidgetException
 
-        self.backend = self.instrument.device_class()
+        with Phidget.channels_lock:
+
+            if self.instrument.address in Phidget.channels:
+                Phidget.channels[self.instrument.address][1] += 1
+            else:
+                backend = self.instrument.device_class()
+
+                backend.setDeviceSerialNumber(serial_number)
 
-        self.backend.setDeviceSerialNumber(serial_number)
+                if len(address_parts) == 2:
+                    backend.setChannel(address_parts[1])
+                if len(address_parts) == 3:
+                    backend.setHubPort(address_parts[1])
+                    backend.setChannel(address_parts[2])
 
-        if len(address_parts) == 2:
-            self.backend.setChannel(address_parts[1])
-        if len(address_parts) == 3:
-            self.backend.setHubPort(address_parts[1])
-            self.backend.setChannel(address_parts[2])
+                latest = {}
 
+                def detached(channel):
+                    # watched values go stale when the device detaches, so getting them falls back to polling until
+                    # the device reports again after it reattaches
+                    latest.clear()
 
+                backend.setOnDetachHandler(detached)
 
-        self.backend.openWaitForAttachment(1000*self.timeout)
+                backend.openWaitForAttachment(1000*self.timeout)
+
+                Phidget.channels[self.instrument.address] = [backend, 1, latest, {}]
+
+            self.backend, _, self.latest, self.buffers = Phidget.channels[self.instrument.address]
 
         self.connected = True
 
-    @chaperone
+    def watch(self, parameter, interval=None):
+        """
+        Have the device report a parameter through its change handler, so that getting it needs no communication
+
+        :param parameter: (str) name of the parameter, as in the get/set methods of the Phidget22 channel, e.g. 'Temperature'
+        :param interval: (int) data interval of the channel in milliseconds; if None, the device's default is used
+        :return: None
+        """
+
+        if parameter in self.buffers:
+            return
+
+        self.buffers[parameter] = collections.deque(maxlen=self.buffer_size)
+
+        def handler(channel, value):
+            # dictionary assignments and deque appends are atomic, so the handler thread needs no lock
+            self.latest[parameter] = value
+            self.buffers[parameter].append((time.time(), value))
+
+        if interval is not None:
+            self.backend.setDataInterval(int(interval))
+
+        try:
+            self.latest[parameter] = self.poll(parameter)  # start with the current value
+        except self.PhidgetException:
+            pass
+
+        self.backend.__getattribute__('setOn' + parameter + 'ChangeHandler')(handler)
+
+    def history(self, parameter):
+        """
+        Get the values of a watched parameter reported since it started being watched, up to the buffer size
+
+        :param parameter: (str) name of the parameter
+        :return: (tuple) arrays of times and values
+        """
+
+        values = list(self.buffers.get(parameter, []))
+
+        if values:
+            times, values = zip(*values)
+            return np.array(times), np.array(values)
+        else:
+            return np.array([]), np.array([])
+
     def get(self, parameter):
 
+        if parameter in self.latest:
+            return self.latest[parameter]
+        else:
+            return self.poll(parameter)
+
+    @chaperone
+    def poll(self, parameter):
+
         try:
             return self.backend.__getattribute__('get'+parameter)()
-        except Phidget.Exception:
+        except self.PhidgetException:
             return float('nan')
 
+    @bounded
     def set(self, parameter, value):
-        set_method = self.backend.__getattribute__('set'+parameter)(value)
+        self.backend.__getattribute__('set'+parameter)(value)
 
     def disconnect(self):
-        self.backend.close()
-        self.connected = True
+
+        with Phidget.channels_lock:
+            if self.instrument.address in Phidget.channels:
+                Phidget.channels[self.instrument.address][1] -= 1
+
+                if Phidget.channels[self.instrument.address][1] <= 0:
+                    Phidget.channels.pop(self.instrument.address)[0].close()
+
+        self.connected = False
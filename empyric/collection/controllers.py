@@ -11,6 +11,7 @@ class OmegaCN7500(Instrument):
 
     supported_adapters = (
         (Modbus, {'parity':'E'}),
+        (ModbusTCP, {}),
     )
 
     knobs = (
@@ -26,6 +27,15 @@ class OmegaCN7500(Instrument):
         'power'
     )
 
+    registers = {
+        'temperature': (0x1000, 'uint16', 0.1),
+        'setpoint': (0x1001, 'uint16', 0.1),
+        'proportional band': (0x1009, 'uint16'),
+        'derivative time': (0x100b, 'uint16'),
+        'integration time': (0x100c, 'uint16'),
+        'power': (0x1012, 'uint16', 0.1),  # output 1 level, in percent
+    }
+
     @setter
     def set_output(self, state):
         if state == 'ON':
@@ -35,43 +45,43 @@ class OmegaCN7500(Instrument):
 
     @setter
     def set_setpoint(self, setpoint):
-        self.write(0x1001, 10*setpoint)
+        self.write_register('setpoint', setpoint)
 
     @getter
     def get_setpoint(self):
-        self.read(0x1001) / 10
+        return self.read_registers('setpoint')['setpoint']
 
     @setter
     def set_proportional_band(self, P):
-        self.write(0x1009, int(P))
+        self.write_register('proportional band', P)
 
     @getter
     def get_proportional_band(self):
-        return self.read(0x1009)
+        return self.read_registers('proportional band')['proportional band']
 
     @setter
     def set_integration_time(self, Ti):
-        self.write(0x100c, int(Ti))
+        self.write_register('integration time', Ti)
 
     @getter
     def get_integration_time(self):
-        return self.read(0x100c)
+        return self.read_registers('integration time')['integration time']
 
     @setter
     def set_derivative_time(self, Td):
-        self.write(0x100b, int(Td))
+        self.write_register('derivative time', Td)
 
     @getter
     def get_derivative_time(self):
-        return self.read(0x100b)
+        return self.read_registers('derivative time')['derivative time']
 
     @measurer
     def measure_temperature(self):
-        return self.read(0x1000) / 10
+        return self.read_registers('temperature')['temperature']
 
     @measurer
     def measure_power(self):
-        return self.read(0x1000) / 10
+        return self.read_registers('power')['power']
 
 
 class RedLionPXU(Instrument):
@@ -83,6 +93,7 @@ class RedLionPXU(Instrument):
 
     supported_adapters = (
         (Modbus, {'buad_rate': 38400}),
+        (ModbusTCP, {}),
     )
 
     knobs = (
@@ -96,6 +107,13 @@ class RedLionPXU(Instrument):
         'power'
     )
 
+    registers = {
+        'temperature': (0x0, 'uint16'),
+        'setpoint': (0x1, 'uint16'),
+        'power': (0x8, 'uint16', 0.1),
+        'autotune': (0xf, 'uint16'),
+    }
+
     @setter
     def set_output(self, state):
         if state == 'ON':
@@ -105,22 +123,22 @@ class RedLionPXU(Instrument):
 
     @setter
     def set_setpoint(self, setpoint):
-        self.write(0x1, int(setpoint))
+        self.write_register('setpoint', setpoint)
 
     @measurer
     def measure_temperature(self):
-        return self.read(0x0)
+        return self.read_registers('temperature')['temperature']
 
     @measurer
     def measure_power(self):
-        return self.read(0x8) / 10
+        return self.read_registers('power')['power']
 
     @setter
     def set_autotune(self, state):
         if state == 'ON':
-            self.write(0xf, 1)
+            self.write_register('autotune', 1)
         elif state == 'OFF':
-            self.write(0xf, 0)
+            self.write_register('autotune', 0)
 
 
 class WatlowEZZone(Instrument):
@@ -132,24 +150,31 @@ class WatlowEZZone(Instrument):
 
     supported_adapters = (
         (Modbus, {'baud_rate': 9600}),
+        (ModbusTCP, {}),
     )
 
     knobs = (
-        'setpoint'
+        'setpoint',
     )
 
     meters = (
         'temperature',
     )
 
+    # floats are in swapped little-endian byte order (= 3 in minimalmodbus)
+    registers = {
+        'temperature': (360, 'float', 1, 3),
+        'setpoint': (2160, 'float', 1, 3),
+    }
+
     @measurer
     def measure_temperature(self):
-        return self.read(360, type='float', byte_order=3)  # swapped little-endian byte order (= 3 in minimalmodbus)
+        return self.read_registers('temperature')['temperature']
 
     @getter
     def get_setpoint(self):
-        return self.read(2160, type='float', byte_order=3)
+        return self.read_registers('setpoint')['setpoint']
 
     @setter
     def set_setpoint(self, setpoint):
-        return self.write(2160, setpoint, type='float', byte_order=3)
+        self.write_register('setpoint', setpoint)
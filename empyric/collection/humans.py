@@ -1,5 +1,7 @@
 # A human is just another instrument
 import time
+import queue
+import threading
 
 from empyric.adapters import *
 from empyric.instruments import *
@@ -13,14 +15,53 @@ class ConsoleUser(Instrument):
     )
 
     knobs = ('prompt',  # message or query to send to user
-             'cooldown')  # minimum time before sending repeat messages
+             'cooldown')  # minimum time in seconds before sending a message again after it is answered
 
-    presets = {'cooldown':0}
+    presets = {'cooldown':60}
 
     meters = ('response',)
 
     last_message = ''
     last_sent = float('-inf')
+    last_response = None
+    response_prompt = None  # prompt to which the last response belongs
+
+    use_console = True  # if False, prompts are left in the prompts queue for a GUI to present and answer
+
+    def __init__(self, *args, **kwargs):
+
+        self.prompts = queue.Queue()  # prompts waiting to be presented to the user
+        self.pending = False  # whether a prompt is waiting for an answer
+
+        if self.use_console:
+            threading.Thread(target=self._console, daemon=True).start()
+
+        Instrument.__init__(self, *args, **kwargs)
+
+    def _console(self):
+        # Presents prompts at the console and collects the answers, on its own thread so that the experiment keeps going
+        while True:
+            prompt = self.prompts.get()
+            self.answer(input(prompt), prompt=prompt)
+
+    def answer(self, response, prompt=None):
+        """
+        Give the user's answer to a prompt
+
+        :param response: (str) the answer
+        :param prompt: (str) the prompt being answered; if None, the last prompt sent
+        :return: None
+        """
+
+        if prompt is None:
+            prompt = self.last_message
+
+        if prompt != self.last_message:  # answer to a prompt that has since been replaced
+            return
+
+        self.last_response = response
+        self.response_prompt = prompt
+        self.pending = False
 
     @setter
     def set_prompt(self, prompt):
@@ -30,16 +71,28 @@ class ConsoleUser(Instrument):
     def set_cooldown(self, cooldown):
         pass
 
-    @measurer
-    def measure_response(self):
-
-        new_message = (self.prompt != self.last_message)
-
-        if time.time() >= self.last_sent + self.cooldown or new_message:  # don't spam user
+    def _send(self):
+        self.pending = True
+        self.prompts.put(self.prompt)
 
-            self.last_response = input(self.prompt)
+        self.last_sent = time.time()
+        self.last_message = self.prompt
 
-            self.last_sent = time.time()
-            self.last_message = self.prompt
+    @measurer
+    def measure_response(self):
 
-        return self.last_response
+        if self.prompt != self.last_message:  # a new message is sent right away, and has no answer yet
+            self.last_response = None
+            self.response_prompt = None
+            self._send()
+            return 'pending'
+
+        # repeat an answered message once the cooldown has passed; don't spam user
+        if not self.pending and time.time() >= self.last_sent + self.cooldown:
+            self._send()
+
+        # the last answer to the current prompt stands until it is answered again
+        if self.response_prompt == self.prompt and self.last_response is not None:
+            return self.last_response
+        else:
+            return 'pending'
@@ -81,6 +81,16 @@ class Instrument:
 
     meters = tuple()
 
+    long_meters = tuple()  # meters whose measurements take long enough that experiments run them in the background
+
+    # register map of the form {..., name: (address, type, scale, byte_order), ...}, for register based instruments
+    registers = {}
+
+    # for acquisitions streamed from an instrument's buffer
+    poll_interval = 0.05  # time between checks of the buffer, in seconds
+    stall_timeout = 10  # time without new points after which the acquisition is considered stalled, in seconds
+    stream_callback = None  # optional callable, called as stream_callback(meter, points) with each batch of new points
+
     def __init__(self, address=None, adapter=None, presets=None, postsets=None, **kwargs):
         """
 
@@ -96,19 +106,41 @@ class Instrument:
         else:
             self.address = 1
 
+        self.lock = threading.RLock()  # held by the thread communicating with this instrument
+
         adapter_connected = False
         if adapter:
             self.adapter = adapter(self, **kwargs)
         else:
+            candidates = list(self.supported_adapters)
+
+            # Try the adapter that last worked for this instrument first
+            cached = ProbeCache.lookup(self.name, self.address)
+            if cached:
+                for _adapter, settings in self.supported_adapters:
+                    if _adapter.__name__ == cached:
+                        candidates.remove((_adapter, settings))
+                        candidates.insert(0, (_adapter, settings))
+                        break
+                else:
+                    cached = None
+
             errors = []
-            for _adapter, settings in self.supported_adapters:
-                settings.update(kwargs)
+            for i, (_adapter, settings) in enumerate(candidates):
+                settings = {**settings, **kwargs}
                 try:
-                    self.adapter = _adapter(self, **settings)
+                    # give up on an adapter that hangs, and disconnect it if it eventually connects
+                    self.adapter = run_with_deadline(_adapter, _adapter.connect_deadline, args=(self,),
+                                                     kwargs=settings, cleanup=lambda late: late.disconnect())
                     adapter_connected = True
+                    ProbeCache.record(self.name, self.address, _adapter.__name__)
+                    break
                 except BaseException as error:
                     errors.append('in trying '+_adapter.__name__+' adapter, got '+type(error).__name__ +': '+ str(error))
 
+                    if cached and i == 0:
+                        ProbeCache.forget(self.name, self.address)
+
             if not adapter_connected:
                 message = f'unable to connect an adapter to instrument {self.name} at address {address}:\n'
                 for error in errors:
@@ -126,27 +158,147 @@ class Instrument:
 
         # Apply presets
         if presets:
-            self.presets.update(presets)
+            self.presets = {**self.presets, **presets}  # instruments are built concurrently, so don't modify the class attribute
 
         for knob, value in self.presets.items():
             self.set(knob, value)
 
         # Get postsets
         if postsets:
-            self.postsets.update(postsets)
+            self.postsets = {**self.postsets, **postsets}
 
     def __repr__(self):
         return self.name
 
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the bus of the instrument's adapter, so that a series of communications with this instrument is not
+        interleaved with communications with other instruments on the same bus. The instrument itself stays locked even
+        while the bus is suspended during a long operation, so other threads cannot use it until the operation is done.
+
+        :return: (context manager) bus transaction
+        """
+
+        with self.lock:
+            with self.adapter.bus.transaction(self.address):
+                yield self
+
     # map write, read and query methods to the adapter's
     def write(self, *args, **kwargs):
-        return self.adapter.write(*args, **kwargs)
+        with self.transaction():
+            return self.adapter.write(*args, **kwargs)
 
     def read(self, *args, **kwargs):
-        return self.adapter.read(*args, **kwargs)
+        with self.transaction():
+            return self.adapter.read(*args, **kwargs)
 
     def query(self, *args, **kwargs):
-        return self.adapter.query(*args, **kwargs)
+        with self.transaction():
+            return self.adapter.query(*args, **kwargs)
+
+    def query_binary(self, *args, **kwargs):
+        with self.transaction():
+            return self.adapter.query_binary(*args, **kwargs)
+
+    def wait_for_completion(self, timeout=None):
+        """
+        Wait for the instrument to complete its pending operations, returning as soon as it does
+
+        :param timeout: (float) maximum waiting time in seconds; if None, wait indefinitely
+        :return: None
+        """
+
+        # the wait is held to its timeout, plus the call deadline for the communications around it
+        if timeout is None or self.adapter.call_deadline is None:
+            deadline = None
+        else:
+            deadline = timeout + self.adapter.call_deadline
+
+        with self.transaction():
+            self.adapter.call_with_deadline(self.adapter.wait_for_completion, deadline, timeout=timeout)
+
+    def read_registers(self, *names):
+        """
+        Read registers from the instrument's register map, in as few transactions as the adapter allows
+
+        :param names: (str) names of the registers to read
+        :return: (dict) scaled register values of the form {..., name: value, ...}
+        """
+
+        register_map = {name: self.registers[name] for name in names}
+
+        with self.transaction():
+            if hasattr(self.adapter, 'read_map'):
+                return self.adapter.read_map(register_map)
+            else:
+                values = {}
+                for name, spec in register_map.items():
+                    address, type, scale, byte_order = register_spec(spec)
+                    values[name] = self.read(address, type=type, byte_order=byte_order) * scale
+                return values
+
+    def write_register(self, name, value):
+        """
+        Write a value to a register in the instrument's register map
+
+        :param name: (str) name of the register
+        :param value: (float/int) unscaled value to write
+        :return: None
+        """
+
+        address, type, scale, byte_order = register_spec(self.registers[name])
+
+        raw = value / scale
+        if type != 'float':
+            raw = int(round(raw))
+
+        self.write(address, raw, type=type, byte_order=byte_order)
+
+    def stream_buffer(self, meter, total, count, fetch, incremental=True):
+        """
+        Follow an acquisition into the instrument's buffer, yielding points as they are acquired; between polls the bus
+        is given up so that other instruments on it can be used
+
+        :param meter: (str) name of the meter being acquired, which is passed on to the stream callback
+        :param total: (int) number of points expected in the buffer
+        :param count: (callable) function which returns the number of points in the buffer so far
+        :param fetch: (callable) function of the indices of the first and last points (counting from 1) to fetch, which returns those points as an array
+        :param incremental: (bool) whether points can be fetched before the buffer is full; if not, the acquisition is still followed to detect stalls
+        :return: (generator) arrays of new points
+        """
+
+        acquired = 0
+        fetched = 0
+        last_progress = time.time()
+
+        while fetched < total:
+
+            with self.transaction():
+                n = min(int(count()), total)
+
+            if n > acquired:
+                acquired = n
+                last_progress = time.time()
+            elif time.time() - last_progress > self.stall_timeout:
+                raise TimeoutError(f'{self.name} acquired no new points of {meter} for {self.stall_timeout} seconds '
+                                   f'({acquired} of {total} points acquired)')
+
+            if acquired > fetched and (incremental or acquired == total):
+
+                with self.transaction():
+                    points = np.asarray(fetch(fetched + 1, acquired))
+
+                fetched = acquired
+
+                if self.stream_callback and len(points) > 0:
+                    self.stream_callback(meter, points)
+
+                yield points
+
+            else:
+                with self.adapter.bus.suspended():
+                    time.sleep(self.poll_interval)
 
     def set(self, knob, value):
         """
@@ -162,12 +314,14 @@ class Instrument:
         except AttributeError:
             raise AttributeError(f"{knob} cannot be set on {self.name}")
 
-        set_method(value)
+        with self.transaction():
+            set_method(value)
 
     def get(self, knob):
 
         if hasattr(self,'get_'+knob.replace(' ','_')):
-            return getattr(self, 'get_'+knob.replace(' ','_'))()
+            with self.transaction():
+                return getattr(self, 'get_'+knob.replace(' ','_'))()
         else:
             return getattr(self, knob.replace(' ','_'))
 
@@ -184,17 +338,85 @@ class Instrument:
         except AttributeError:
             raise AttributeError(f"{meter} cannot be measured on {self.name}")
 
-        measurement = measure_method()
+        with self.transaction():
+            measurement = measure_method()
 
         return measurement
 
+    def measure_many(self, meters):
+        """
+        Measure several variables associated with this instrument in as few exchanges as possible; meters named after
+        registers in the register map are read together, and the rest are measured one by one. Drivers which can
+        measure several meters at once extend this method.
+
+        :param meters: (iterable) names of the variables to be measured
+        :return: (dict) measured values of the form {..., meter: value, ...}
+        """
+
+        measurements = {}
+
+        with self.transaction():
+
+            registered = [meter for meter in meters if meter in self.registers]
+            if registered:
+                measurements.update(self.read_registers(*registered))
+
+            for meter in meters:
+                if meter not in measurements:
+                    measurements[meter] = self.measure(meter)
+
+        return {meter: measurements[meter] for meter in meters}
+
+    def get_many(self, knobs):
+        """
+        Get the values of several knobs of this instrument in one bus transaction; knobs named after registers in the
+        register map are read together, like meters in measure_many, and the rest are gotten one by one
+
+        :param knobs: (iterable) names of the knobs
+        :return: (dict) knob values of the form {..., knob: value, ...}
+        """
+
+        return self.read_many(knobs=knobs)[0]
+
+    def read_many(self, knobs=(), meters=()):
+        """
+        Get several knobs and measure several meters of this instrument in one bus transaction; all knobs and meters
+        named after registers in the register map are read together, in as few exchanges as the adapter allows
+
+        :param knobs: (iterable) names of the knobs
+        :param meters: (iterable) names of the meters
+        :return: (tuple) knob values and measured values, as dictionaries of the form {..., name: value, ...}
+        """
+
+        with self.transaction():
+
+            registered = [knob for knob in knobs
+                          if knob in self.registers and hasattr(self, 'get_' + knob.replace(' ', '_'))]
+            registered += [meter for meter in meters if meter in self.registers and meter not in registered]
+
+            values = self.read_registers(*registered) if registered else {}
+
+            knob_values = {}
+            for knob in knobs:
+                if knob in values:
+                    knob_values[knob] = values[knob]
+                    self.__setattr__(knob.replace(' ', '_'), values[knob])  # record the value, as the getters do
+                else:
+                    knob_values[knob] = self.get(knob)
+
+            others = [meter for meter in meters if meter not in values]
+            measurements = {**values, **(self.measure_many(others) if others else {})}
+
+        return knob_values, {meter: measurements[meter] for meter in meters}
+
     def disconnect(self):
 
         if self.adapter.connected:
-            for knob, value in self.postsets.items():
-                self.set(knob, value)
+            with self.transaction():
+                for knob, value in self.postsets.items():
+                    self.set(knob, value)
 
-            self.adapter.disconnect()
+                self.adapter.disconnect()
         else:
             raise ConnectionError(f"adapter for {self.name} is not connected!")
 
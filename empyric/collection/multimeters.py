@@ -1,4 +1,4 @@
-import numbers, importlib
+import numbers, importlib, threading, collections
 from empyric.adapters import *
 from empyric.collection.instrument import *
 
@@ -112,19 +112,37 @@ class Keithley2110(Instrument):
 class LabJackU6(Instrument):
     """
     LabJack U6 Multi-function DAQ
+
+    Analog inputs are read with one batched feedback command per step. With the stream knob on, the inputs are
+    instead sampled continuously by the device at the scan frequency into ring buffers, and each measurement returns
+    the latest sample, the mean of the samples since the last measurement or the block of those samples, according to
+    the stream mode knob.
     """
 
     name = 'LabJackU6'
 
     supported_adapters = (
-        (Adapter, {})  # custom setup below until I can get serial or modbus comms to work
+        (Adapter, {}),  # custom setup below until I can get serial or modbus comms to work
     )
 
     knobs = (
-        'DAC0 ',
+        'DAC0',
         'DAC1',
+        'scan frequency',
+        'stream mode',
+        'stream',
     )
 
+    presets = {
+        'scan frequency': 1000,  # Hz
+        'stream mode': 'mean',  # 'latest', 'mean' or 'block'
+        'stream': 'OFF',
+    }
+
+    postsets = {
+        'stream': 'OFF'
+    }
+
     meters = (
         'AIN0',
         'AIN1',
@@ -137,12 +155,25 @@ class LabJackU6(Instrument):
         'temperature 3',
     )
 
+    stream_channels = (0, 1, 2, 3)
+    temperature_channel = 14  # internal temperature sensor
+    buffer_size = 100000  # samples kept per channel while streaming
+
     def __init__(self, *args, **kwargs):
 
-        u6 = importlib.import_module('u6')
-        self.backend = u6.U6()
+        self.u6 = importlib.import_module('u6')
+        self.backend = self.u6.U6()
+        self.backend.getCalibrationData()
+
+        self.streaming = False
+        self.stream_thread = None
+        self.stream_error = None  # error which stopped the stream thread, if any
+        self.stream_lock = threading.Lock()
+        self.buffers = {channel: collections.deque(maxlen=self.buffer_size) for channel in self.stream_channels}
+        self.latest = {channel: float('nan') for channel in self.stream_channels}
+        self.internal_temperature = None
 
-        if address not in kwargs:
+        if not args and 'address' not in kwargs:
             kwargs['address'] = str(self.backend.serialNumber)
 
         Instrument.__init__(self, *args, **kwargs)
@@ -153,6 +184,99 @@ class LabJackU6(Instrument):
     def read(self, register):
         return self.backend.readRegister(register)
 
+    def _read_channels(self, channels):
+        # Read several analog inputs with a single feedback command; the internal temperature sensor is read in kelvin
+
+        commands = [self.u6.AIN24(channel, ResolutionIndex=0, GainIndex=0, SettlingFactor=0) for channel in channels]
+        results = self.backend.getFeedback(*commands)
+
+        values = {}
+        for channel, bits in zip(channels, results):
+            if channel == self.temperature_channel:
+                values[channel] = self.backend.binaryToCalibratedAnalogTemperature(bits)
+            else:
+                values[channel] = self.backend.binaryToCalibratedAnalogVoltage(0, bits, is16Bits=False)
+
+        return values
+
+    def _stream(self):
+        # Runs on a background thread, moving samples from the device's stream into the ring buffers; an error that
+        # stops the thread is recorded, so that measurements report it instead of returning stale samples
+
+        try:
+            for packet in self.backend.streamData(convert=True):
+
+                if not self.streaming:
+                    break
+
+                if packet is None:  # no data yet
+                    continue
+
+                with self.stream_lock:
+                    for channel in self.stream_channels:
+                        self.buffers[channel].extend(packet['AIN%d' % channel])
+
+        except BaseException as error:
+            self.stream_error = error
+
+    def _streamed_value(self, channel):
+        # Collect the samples of a channel that arrived since its last measurement
+
+        if self.stream_error is not None:
+            raise ConnectionError(f'stream of {self.name} stopped with {type(self.stream_error).__name__}: '
+                                  f'{self.stream_error}; turn the stream off and on again to restart it')
+
+        with self.stream_lock:
+            samples = np.array(self.buffers[channel])
+            self.buffers[channel].clear()
+
+        if len(samples) > 0:
+            self.latest[channel] = samples[-1]
+
+        if self.stream_mode == 'block':
+            return samples
+        elif self.stream_mode == 'latest' or len(samples) == 0:
+            return self.latest[channel]
+        else:
+            return np.mean(samples)
+
+    def measure_many(self, meters):
+
+        # Find the analog inputs needed for these meters
+        channels = set()
+        for meter in meters:
+            if meter.startswith('AIN'):
+                channels.add(int(meter[3:]))
+            elif meter.startswith('temperature '):
+                channels.add(int(meter.split(' ')[-1]))
+                channels.add(self.temperature_channel)
+            elif meter == 'internal temperature':
+                channels.add(self.temperature_channel)
+
+        with self.transaction():
+            if self.streaming:
+                values = {channel: self._streamed_value(channel) for channel in channels
+                          if channel != self.temperature_channel}
+
+                # the temperature sensor is not streamed; it changes slowly, so use the reading from the start of the stream
+                values[self.temperature_channel] = self.internal_temperature
+            else:
+                values = self._read_channels(sorted(channels))
+
+        measurements = {}
+        for meter in meters:
+            if meter.startswith('AIN'):
+                measurements[meter] = values[int(meter[3:])]
+            elif meter.startswith('temperature '):
+                internal_temperature = values[self.temperature_channel] - 273.15
+                measurements[meter] = values[int(meter.split(' ')[-1])] / 37e-6 + internal_temperature
+            elif meter == 'internal temperature':
+                measurements[meter] = values[self.temperature_channel] - 273.15
+            else:
+                measurements[meter] = self.measure(meter)
+
+        return measurements
+
     @setter
     def set_DAC0(self, value):
         self.write(5000, value)
@@ -163,44 +287,90 @@ class LabJackU6(Instrument):
 
     @getter
     def get_DAC0(self):
-        self.read(5000)
+        return self.read(5000)
 
     @getter
     def get_DAC1(self):
-        self.read(5002)
+        return self.read(5002)
+
+    @setter
+    def set_scan_frequency(self, frequency):
+
+        if self.streaming:  # restart the stream at the new frequency
+            self.set_stream('OFF')
+            self.set_stream('ON')
+
+    @setter
+    def set_stream_mode(self, mode):
+
+        if mode not in ['latest', 'mean', 'block']:
+            raise ValueError('stream mode must be "latest", "mean" or "block"')
+
+    @setter
+    def set_stream(self, stream):
+
+        if stream in [1, 'ON', 'on'] and not self.streaming:
+
+            self.internal_temperature = self._read_channels([self.temperature_channel])[self.temperature_channel]
+
+            self.backend.streamConfig(NumChannels=len(self.stream_channels), ChannelNumbers=list(self.stream_channels),
+                                      ChannelOptions=[0]*len(self.stream_channels), SettlingFactor=1,
+                                      ResolutionIndex=1, ScanFrequency=self.scan_frequency)
+
+            for buffer in self.buffers.values():
+                buffer.clear()
+
+            self.stream_error = None
+            self.streaming = True
+            self.backend.streamStart()
+
+            self.stream_thread = threading.Thread(target=self._stream, daemon=True)
+            self.stream_thread.start()
+
+        elif stream in [0, 'OFF', 'off'] and self.streaming:
+
+            self.streaming = False
+            self.stream_thread.join()
+
+            try:
+                self.backend.streamStop()
+            except BaseException as error:
+                if self.stream_error is None:
+                    raise
+                warnings.warn(f'unable to stop the failed stream of {self.name}: {error}')
 
     @measurer
     def measure_AIN0(self):
-        return self.read(0)
+        return self.measure_many(['AIN0'])['AIN0']
 
     @measurer
     def measure_AIN1(self):
-        return self.read(2)
+        return self.measure_many(['AIN1'])['AIN1']
 
     @measurer
     def measure_AIN2(self):
-        return self.read(4)
+        return self.measure_many(['AIN2'])['AIN2']
 
     @measurer
     def measure_AIN3(self):
-        return self.read(6)
+        return self.measure_many(['AIN3'])['AIN3']
 
     @measurer
     def measure_internal_temperature(self):
-        return self.backend.getTemperature() - 273.15
+        return self.measure_many(['internal temperature'])['internal temperature']
 
     @measurer
     def measure_temperature_0(self):
-        return self.read(0) / 37e-6 + self.measure_internal_temperature()
+        return self.measure_many(['temperature 0'])['temperature 0']
 
     @measurer
     def measure_temperature_1(self):
-        return self.read(2) / 37e-6 + self.measure_internal_temperature()
+        return self.measure_many(['temperature 1'])['temperature 1']
 
     @measurer
     def measure_temperature_2(self):
-        return self.read(4) / 37e-6 + self.measure_internal_temperature()
+        return self.measure_many(['temperature 2'])['temperature 2']
 
     @measurer
     def measure_temperature_3(self):
-        return self.read(6) / 37e-6 + self.measure_internal_temperature()
+        return self.measure_many(['temperature 3'])['temperature 3']
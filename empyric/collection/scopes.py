@@ -27,6 +27,7 @@ class TekScope(Instrument):
         'ch4 scale',
         'ch4 position',
         'trigger level',
+        'channels',  # channels acquired together from a single trigger
     )
 
     meters = (
@@ -36,66 +37,158 @@ class TekScope(Instrument):
         'channel 4',
     )
 
+    long_meters = meters
+
+    acquisition_timeout = 60  # maximum time to wait for a trigger, in seconds
+
+    def __init__(self, *args, **kwargs):
+
+        self.preambles = {}  # cached waveform preambles of the form {..., channel: (multiplier, zero, offset), ...}
+        self.data_source = None  # channel currently selected for waveform transfers
+        self.acquisition = {}  # waveforms from the last trigger that have not been measured yet
+
+        Instrument.__init__(self, *args, **kwargs)
+
+        # Transfer waveforms as signed 8-bit integers, without response headers
+        self.write('HEAD OFF')
+        self.write('DAT:ENC RIB')
+        self.write('DAT:WID 1')
+
+        # Stop after each acquisition, so that all channels are transferred from the same trigger
+        self.write('ACQ:STOPA SEQ')
+
     @setter
     def set_horz_scale(self, scale):
         self.write('HOR:SCA %.3e' % scale)
+        self._changed()
 
     @setter
     def set_horz_position(self, position):
-        self.write('HOR:POS %.3e' % scale)
+        self.write('HOR:POS %.3e' % position)
+        self._changed()
+
+    def _changed(self, channel=None):
+        # Waveforms acquired before a change of the settings are dropped; changing the scale or position of a channel
+        # also changes its waveform preamble, which is then re-read
+
+        self.acquisition = {}
+
+        if channel is not None:
+            self.preambles.pop(channel, None)
 
     @setter
     def set_ch1_scale(self, scale):
         self.write('CH1:SCA %.3e' % scale)
+        self._changed(1)
 
     @setter
     def set_ch2_scale(self, scale):
-        self.write('CH1:SCA %.3e' % scale)
+        self.write('CH2:SCA %.3e' % scale)
+        self._changed(2)
 
     @setter
     def set_ch3_scale(self, scale):
-        self.write('CH1:SCA %.3e' % scale)
+        self.write('CH3:SCA %.3e' % scale)
+        self._changed(3)
 
     @setter
     def set_ch4_scale(self, scale):
-        self.write('CH1:SCA %.3e' % scale)
+        self.write('CH4:SCA %.3e' % scale)
+        self._changed(4)
 
     @setter
     def set_ch1_position(self, position):
         self.write('CH1:POS %.3e' % position)
+        self._changed(1)
 
     @setter
     def set_ch2_position(self, position):
-        self.write('CH1:POS %.3e' % position)
+        self.write('CH2:POS %.3e' % position)
+        self._changed(2)
 
     @setter
     def set_ch3_position(self, position):
-        self.write('CH1:POS %.3e' % position)
+        self.write('CH3:POS %.3e' % position)
+        self._changed(3)
 
     @setter
     def set_ch4_position(self, position):
-        self.write('CH1:POS %.3e' % position)
+        self.write('CH4:POS %.3e' % position)
+        self._changed(4)
 
     @setter
     def set_trigger_level(self, level):
         self.write('TRIG:MAI:LEV %.3e' % level)
+        self._changed()
 
-    def _measure_channel(self, channel):
+    @setter
+    def set_channels(self, channels):
+        self._changed()
+
+    def _select_source(self, channel):
 
-        self.write('DAT:ENC ASCI') # ensure ASCII encoding of data
-        self.write('DAT:SOU CH%d' % channel)  # switch to channel 1
+        if channel != self.data_source:
+            self.write('DAT:SOU CH%d' % channel)
+            self.data_source = channel
 
-        scale_factor = float(self.query('WFMPRE:YMULT?'))
-        zero = float(self.query('WFMPRE:YZERO?'))
-        offset = float(self.query('WFMPRE:YOFF?'))
+    def _get_preamble(self, channel):
 
-        self.write('ACQ:STATE RUN') # acquire the waveform
+        if channel not in self.preambles:
+            self._select_source(channel)
+            response = self.query('WFMPRE:YMULT?;YZERO?;YOFF?')
+            self.preambles[channel] = tuple(float(value) for value in response.split(';'))
+
+        return self.preambles[channel]
+
+    def measure_channels(self, channels):
+        """
+        Acquire the waveforms of several channels from a single trigger
+
+        :param channels: (iterable) channel numbers
+        :return: (dict) waveforms of the form {..., channel: waveform, ...}
+        """
+
+        channels = sorted(set(channels))
+
+        self.acquisition = {}  # waveforms left from an earlier trigger are superseded
+
+        with self.transaction():
+
+            preambles = {channel: self._get_preamble(channel) for channel in channels}
+
+            self.write('ACQ:STATE RUN')  # arm once for all channels
+            self.wait_for_completion(timeout=self.acquisition_timeout)
+
+            waveforms = {}
+            for channel in channels:
+                scale_factor, zero, offset = preambles[channel]
+
+                self._select_source(channel)
+                raw_data = self.query_binary('CURVE?', dtype='i1')
+
+                waveforms[channel] = (raw_data - offset) * scale_factor + zero
+
+        return waveforms
+
+    def measure_many(self, meters):
+
+        # All requested channels come from a single acquisition
+        channels = [int(meter.split(' ')[-1]) for meter in meters if meter.startswith('channel ')]
+        waveforms = self.measure_channels(channels) if channels else {}
+
+        measurements = {f'channel {channel}': waveform for channel, waveform in waveforms.items()}
+        measurements.update(Instrument.measure_many(self, [meter for meter in meters if meter not in measurements]))
+
+        return {meter: measurements[meter] for meter in meters}
+
+    def _measure_channel(self, channel):
 
-        while int(self.query('BUSY?')):
-            time.sleep(1)  # wait for acquisition to complete
+        # Channels of the same group are measured from one acquisition, until they have all been measured; a channel
+        # that was already taken from the acquisition, or is not part of it, gets a new one for the whole group
+        if channel not in self.acquisition:
+            self.acquisition = self.measure_channels(set(self.channels or []) | {channel})
 
-        str_data = self.query('CURVE?').split(' ')[1].split(',')
-        return np.array([ ( float(datum) - offset )*scale_factor + zero for datum in str_data ])
+        return self.acquisition.pop(channel)
 
     @measurer
     def measure_channel_1(self):
@@ -7,6 +7,7 @@ import numbers
 
 from empyric.adapters import *
 from empyric.collection.instrument import *
+from empyric.tables import TableCache
 
 class Keithley2400(Instrument):
     """
@@ -59,8 +60,13 @@ class Keithley2400(Instrument):
         'fast currents'
     )
 
+    long_meters = ('fast currents',)
+
     fast_voltages = None
 
+    list_length = 100  # maximum number of voltages in a source list
+    buffer_size = 2500  # maximum number of readings in the trace buffer
+
     @setter
     def set_source(self, variable):
 
@@ -115,7 +121,7 @@ class Keithley2400(Instrument):
         self.set_output('ON')
 
         def validator(response):
-            match = re.match('.\d\.\d+E.\d\d', response)
+            match = re.match(r'.\d\.\d+E.\d\d', response)
             return bool(match)
 
         return float(self.query(':READ?', validator=validator))
@@ -129,11 +135,40 @@ class Keithley2400(Instrument):
         self.set_output('ON')
 
         def validator(response):
-            match = re.match('.\d\.\d+E.\d\d', response)
+            match = re.match(r'.\d\.\d+E.\d\d', response)
             return bool(match)
 
         return float(self.query(':READ?', validator=validator))
 
+    def measure_many(self, meters):
+
+        if not {'voltage', 'current'}.issubset(meters):
+            return Instrument.measure_many(self, meters)
+
+        with self.transaction():
+
+            self.set_output('ON')
+
+            # Read voltage and current from a single reading, then go back to the selected meter
+            self.write(':SENS:FUNC "VOLT","CURR"')
+            self.write(':FORM:ELEM VOLT,CURR')
+
+            def validator(response):
+                match = re.match(r'.\d\.\d+E.\d\d,.\d\.\d+E.\d\d', response)
+                return bool(match)
+
+            voltage, current = [float(value) for value in self.query(':READ?', validator=validator).split(',')]
+
+            function = 'VOLT' if self.meter == 'voltage' else 'CURR'
+            self.write(':SENS:FUNC:OFF:ALL')  # turning one function on does not turn the other off
+            self.write(':SENS:FUNC "%s"' % function)
+            self.write(':FORM:ELEM ' + function)
+
+            others = [meter for meter in meters if meter not in ('voltage', 'current')]
+            measurements = {'voltage': voltage, 'current': current, **Instrument.measure_many(self, others)}
+
+        return {meter: measurements[meter] for meter in meters}
+
     @setter
     def set_voltage(self, voltage):
 
@@ -240,64 +275,125 @@ class Keithley2400(Instrument):
 
         # import fast voltages, if specified as a path
         if type(self.fast_voltages) == str:  # can be specified as a path
-            try:
-                fast_voltage_data = pd.read_csv(self.fast_voltages)
-            except FileNotFoundError:
-                # probably in an experiment data directory; try going up a level
-                working_subdir = os.getcwd()
-                os.chdir('..')
-                fast_voltage_data = pd.read_csv(self.fast_voltages)
-                os.chdir(working_subdir)
+            fast_voltage_data = TableCache.read_csv(self.fast_voltages)  # also looks in the parent directory
 
             columns = fast_voltage_data.columns
             self.fast_voltages = fast_voltage_data[columns[0]].astype(float).values
 
-    @measurer
-    def measure_fast_currents(self):
+    @staticmethod
+    def _sweep_spacing(voltages):
+        # Determine whether the voltages can be swept with the built-in linear or logarithmic sweep
 
-        if self.source != 'voltage':
-            self.set_source('voltage')
+        if len(voltages) < 3:
+            return None
 
-        self.set_output('ON')
+        steps = np.diff(voltages)
+        if steps[0] != 0 and np.allclose(steps, steps[0], rtol=1e-6, atol=1e-9):
+            return 'LIN'
 
-        try:
-            if len(self.fast_voltages) == 0:
-                raise ValueError('Fast IV sweep voltages have not been set!')
-        except AttributeError:
-            raise ValueError('Fast IV sweep voltages have not been set!')
+        if np.all(voltages > 0) or np.all(voltages < 0):
+            ratios = voltages[1:] / voltages[:-1]
+            if ratios[0] != 1 and np.allclose(ratios, ratios[0], rtol=1e-6):
+                return 'LOG'
+
+        return None
+
+    def _fetch_currents(self, first, last):
+        # The trace buffer can only be read as a whole, as little-endian single precision floats
+
+        self.write(':FORM:DATA SREAL')
+        self.write(':FORM:BORD SWAP')
+        currents = self.query_binary(':TRAC:DATA?', dtype='<f4', count=last - first + 1)
+        self.write(':FORM:DATA ASC')
+
+        self.write(':TRAC:FEED:CONT NEV')
+
+        return currents.astype(float)
+
+    def _sweep_batch(self, voltages):
+        # Sweep through up to one trace buffer's worth of voltages, yielding the currents once the buffer is full
+
+        points = len(voltages)
+
+        with self.transaction():
+            self.write(':TRAC:CLE')
+            self.write(':TRAC:POIN %d' % points)
+            self.write(':TRAC:FEED SENS')
+            self.write(':TRAC:FEED:CONT NEXT')
+
+        count = lambda: float(self.query(':TRAC:POIN:ACT?'))
+
+        spacing = self._sweep_spacing(voltages)
 
-        self.write(':SOUR:VOLT:MODE LIST')
+        if spacing:
+            with self.transaction():
+                self.write(':SOUR:VOLT:MODE SWE')
+                self.write(':SOUR:SWE:SPAC ' + spacing)
+                self.write(':SOUR:VOLT:STAR %.6E' % voltages[0])
+                self.write(':SOUR:VOLT:STOP %.6E' % voltages[-1])
+                self.write(':SOUR:SWE:POIN %d' % points)
+                self.write(':TRIG:COUN %d' % points)
+                self.write(':INIT')
 
-        list_length = len(self.fast_voltages)
+            yield from self.stream_buffer('fast currents', points, count, self._fetch_currents, incremental=False)
 
-        if list_length >= 100:  # can only take 100 voltages at a time
-            sub_lists = [self.fast_voltages[i*100:(i+1)*100] for i in range(list_length // 100)]
         else:
-            sub_lists = []
+            self.write(':SOUR:VOLT:MODE LIST')
+
+            # Lists are uploaded, swept and followed strictly in sequence, with no overlap of uploads and readout:
+            # - the 2400 holds a single source list, so the next list cannot be uploaded while the current one sweeps
+            # - queueing the uploads behind *WAI would hold off the buffer queries that follow the progress of the
+            #   sweep and detect stalls
+            # - the trace buffer can only be read once it is full, so currents cannot be read out during the sweep
+            for i in range(0, points, self.list_length):
+                voltage_list = voltages[i:i + self.list_length]
+
+                with self.transaction():
+                    self.write(':SOUR:LIST:VOLT ' + ','.join(['%.6G' % voltage for voltage in voltage_list]))
+                    self.write(':TRIG:COUN %d' % len(voltage_list))
+                    self.write(':INIT')
+
+                # follow the progress through this list, and get the whole buffer after the last one
+                if i + self.list_length < points:
+                    for _ in self.stream_buffer('fast currents', i + len(voltage_list), count, lambda *_: []):
+                        pass
+                else:
+                    yield from self.stream_buffer('fast currents', points, count, self._fetch_currents,
+                                                  incremental=False)
+
+    def stream_fast_currents(self):
+        """
+        Run the fast IV sweep, yielding currents as they are measured; the trace buffer of this instrument can only be
+        read once it is full, so currents come in batches of up to one buffer size
+
+        :return: (generator) arrays of new currents
+        """
 
-        if list_length % 100 > 0:
-            sub_lists.append(self.fast_voltages[-(list_length % 100):])
+        try:
+            if len(self.fast_voltages) == 0:
+                raise ValueError('Fast IV sweep voltages have not been set!')
+        except (AttributeError, TypeError):
+            raise ValueError('Fast IV sweep voltages have not been set!')
 
-        current_list = []
+        voltages = np.asarray(self.fast_voltages, dtype=float)
 
-        normal_timeout = self.adapter.timeout
-        self.adapter.timeout = None  # the response times can be long
+        with self.transaction():
+            if self.source != 'voltage':
+                self.set_source('voltage')
 
-        start = datetime.datetime.now()
-        for voltage_list in sub_lists:
-            voltage_str = ', '.join(['%.4E' % voltage for voltage in voltage_list])
-            self.write(':SOUR:LIST:VOLT ' + voltage_str)
-            self.write(':TRIG:COUN %d' % len(voltage_list))
+            if self.meter != 'current':
+                self.set_meter('current')
 
-            raw_response = self.query(':READ?').strip()
-            current_list += [float(current_str) for current_str in raw_response.split(',')]
-        end = datetime.datetime.now()
+            self.set_output('ON')
 
-        self.adapter.timeout = normal_timeout  # put it back
+        for i in range(0, len(voltages), self.buffer_size):
+            yield from self._sweep_batch(voltages[i:i + self.buffer_size])
 
         self.write(':SOUR:VOLT:MODE FIX')
 
-        return np.array(current_list)
+    @measurer
+    def measure_fast_currents(self):
+        return np.concatenate(list(self.stream_fast_currents()))
 
     @setter
     def set_source_delay(self, delay):
@@ -314,7 +410,8 @@ class Keithley2460(Instrument):
     supported_adapters = (
         (VISAGPIB, {}),
         (LinuxGPIB, {}),
-        (PrologixGPIB, {})
+        (PrologixGPIB, {}),
+        (SocketSCPI, {})
     )
 
     # Available knobs
@@ -355,7 +452,13 @@ class Keithley2460(Instrument):
         'fast currents'
     )
 
+    long_meters = ('fast currents',)
+
     fast_voltages = None
+    uploaded_voltages = None  # source list currently stored on the instrument
+
+    list_length = 100  # maximum number of voltages sent in one command
+    batch_size = 2500  # maximum number of voltages in one sweep
 
     @setter
     def set_source(self, variable):
@@ -524,61 +627,69 @@ class Keithley2460(Instrument):
 
         # import fast voltages, if specified as a path
         if type(self.fast_voltages) == str:  # can be specified as a path
-            try:
-                fast_voltage_data = pd.read_csv(self.fast_voltages)
-            except FileNotFoundError:
-                # probably in an experiment data directory; try going up a level
-                working_subdir = os.getcwd()
-                os.chdir('..')
-                fast_voltage_data = pd.read_csv(self.fast_voltages)
-                os.chdir(working_subdir)
+            fast_voltage_data = TableCache.read_csv(self.fast_voltages)  # also looks in the parent directory
 
             columns = fast_voltage_data.columns
             self.fast_voltages = fast_voltage_data[columns[0]].astype(float).values
 
-    @measurer
-    def measure_fast_currents(self):
+    def _upload_voltages(self, voltages):
+        # Upload the source configuration list, unless it is the one already on the instrument
 
-        try:
-            self.fast_voltages
-        except AttributeError:
-            raise ValueError('Fast IV sweep voltages have not been set!')
+        if self.uploaded_voltages is not None and np.array_equal(voltages, self.uploaded_voltages):
+            return
 
-        if len(self.fast_voltages) == 0:
-            raise ValueError('Fast IV sweep voltages have not been set!')
+        for i in range(0, len(voltages), self.list_length):
+            voltage_str = ','.join(['%.6G' % voltage for voltage in voltages[i:i + self.list_length]])
 
-        path = self.name+'-fast_iv_measurement.csv'
+            if i == 0:
+                self.write('SOUR:LIST:VOLT ' + voltage_str)
+            else:
+                self.write('SOUR:LIST:VOLT:APP ' + voltage_str)
 
-        list_length = len(self.fast_voltages)
+        self.uploaded_voltages = voltages
 
-        if list_length >= 100:
-            sub_lists = [self.fast_voltages[i*100:(i+1)*100] for i in range(list_length // 100)]
-        else:
-            sub_lists = []
+    def _fetch_currents(self, first, last):
+        # Read a range of the buffer as little-endian single precision floats
 
-        if list_length % 100 > 0:
-            sub_lists.append(self.fast_voltages[-(list_length % 100):])
+        self.write('FORM:DATA SRE')
+        self.write('FORM:BORD SWAP')
+        currents = self.query_binary('TRAC:DATA? %d, %d, "defbuffer1", READ' % (first, last),
+                                     dtype='<f4', count=last - first + 1)
+        self.write('FORM:DATA ASC')
 
-        current_list = []
+        return currents.astype(float)
 
-        normal_timeout = self.adapter.timeout
-        self.adapter.timeout = None  # the response times can be long
+    def stream_fast_currents(self):
+        """
+        Run the fast IV sweep, yielding currents as they are measured
 
-        start = datetime.datetime.now()
-        for voltage_list in sub_lists:
+        :return: (generator) arrays of new currents
+        """
 
-            voltage_str = ', '.join(['%.4E' % voltage for voltage in voltage_list])
-            self.write('SOUR:LIST:VOLT ' + voltage_str)
-            self.write('SOUR:SWE:VOLT:LIST 1, %.2e' % self.source_delay)
-            self.write('INIT')
-            self.write('*WAI')
-            raw_response = self.query('TRAC:DATA? 1, %d, "defbuffer1", SOUR, READ' % len(voltage_list)).strip()
-            current_list += [float(current_str) for current_str in raw_response.split(',')[1::2]]
+        try:
+            if len(self.fast_voltages) == 0:
+                raise ValueError('Fast IV sweep voltages have not been set!')
+        except (AttributeError, TypeError):
+            raise ValueError('Fast IV sweep voltages have not been set!')
 
-        self.adapter.timeout = normal_timeout  # put it back
-        end = datetime.datetime.now()
+        voltages = np.asarray(self.fast_voltages, dtype=float)
 
-        return np.array(current_list)
+        for i in range(0, len(voltages), self.batch_size):
+            batch = voltages[i:i + self.batch_size]
+
+            # The instrument runs each sweep on its own
+            with self.transaction():
+                self._upload_voltages(batch)
+                self.write('SOUR:SWE:VOLT:LIST 1, %.2e' % self.source_delay)
+                self.write('TRAC:CLE "defbuffer1"')
+                self.write('INIT')
+
+            yield from self.stream_buffer('fast currents', len(batch),
+                                          lambda: float(self.query('TRAC:ACT? "defbuffer1"')), self._fetch_currents)
+
+    @measurer
+    def measure_fast_currents(self):
+        return np.concatenate(list(self.stream_fast_currents()))
 
     @setter
     def set_source_delay(self, delay):
@@ -599,7 +710,8 @@ class Keithley2651A(Instrument):
     supported_adapters = (
         (VISAGPIB, {}),
         (LinuxGPIB, {}),
-        (PrologixGPIB, {})
+        (PrologixGPIB, {}),
+        (SocketSCPI, {})
     )
 
     # Available knobs
@@ -639,7 +751,38 @@ class Keithley2651A(Instrument):
         'fast currents'
     )
 
+    long_meters = ('fast currents',)
+
     fast_voltages = None
+    uploaded_voltages = None  # sweep voltages currently stored on the instrument
+
+    list_length = 100  # maximum number of voltages sent in one command
+    settle_time = 0.01  # time to let the current settle at each voltage before measuring it, in seconds
+
+    # TSP script which sweeps through the voltages in the table empyric_voltages with the instrument's trigger model,
+    # measuring the current at each voltage into smua.nvbuffer1 after the given settling time
+    sweep_script = """
+    loadscript EmpyricSweep
+    function empyric_append(values)
+        for i = 1, table.getn(values) do
+            table.insert(empyric_voltages, values[i])
+        end
+    end
+    function empyric_sweep(settle)
+        smua.measure.delay = settle
+        smua.nvbuffer1.clear()
+        smua.nvbuffer1.appendmode = 1
+        smua.nvbuffer1.collectsourcevalues = 0
+        smua.trigger.source.listv(empyric_voltages)
+        smua.trigger.source.action = smua.ENABLE
+        smua.trigger.measure.i(smua.nvbuffer1)
+        smua.trigger.measure.action = smua.ENABLE
+        smua.trigger.arm.count = 1
+        smua.trigger.count = table.getn(empyric_voltages)
+        smua.trigger.initiate()
+    end
+    endscript
+    """
 
     @setter
     def set_source(self, variable):
@@ -744,62 +887,86 @@ class Keithley2651A(Instrument):
 
         # import fast voltages, if specified as a path
         if type(self.fast_voltages) == str:  # can be specified as a path
-            try:
-                fast_voltage_data = pd.read_csv(self.fast_voltages)
-            except FileNotFoundError:
-                # probably in an experiment data directory; try going up a level
-                working_subdir = os.getcwd()
-                os.chdir('..')
-                fast_voltage_data = pd.read_csv(self.fast_voltages)
-                os.chdir(working_subdir)
+            fast_voltage_data = TableCache.read_csv(self.fast_voltages)  # also looks in the parent directory
 
             columns = fast_voltage_data.columns
             self.fast_voltages = fast_voltage_data[columns[0]].astype(float).values
 
-    @measurer
-    def measure_fast_currents(self):
+    def _load_sweep_script(self):
+        # The script is stored in volatile memory, so check that it is still there before each sweep
 
-        try:
-            if len(self.fast_voltages) == 0:
-                raise ValueError('Fast IV sweep voltages have not been set!')
-        except AttributeError:
-            raise ValueError('Fast IV sweep voltages have not been set!')
+        if self.query('print(empyric_sweep ~= nil)').strip() != 'true':
+            for line in self.sweep_script.strip().splitlines():
+                self.write(line.strip())
 
-        voltage_lists = []
-        current_list = []
+            self.write('EmpyricSweep.run()')  # defines the functions of the script
+            self.uploaded_voltages = None
 
-        list_length = 100  # maximum number of voltages to sweep at a time
+    def _upload_voltages(self, voltages):
+        # Upload the sweep voltages to a table on the instrument, unless they are already there
 
-        for i in range(len(self.fast_voltages) // list_length):
-            voltage_lists.append(self.fast_voltages[i*list_length:(i+1)*list_length])
+        if self.uploaded_voltages is not None and np.array_equal(voltages, self.uploaded_voltages):
+            return
 
-        remainder = len(self.fast_voltages) % list_length
-        if remainder:
-            voltage_lists.append(self.fast_voltages[-remainder:])
+        self.write('empyric_voltages = {}')
 
-        normal_timeout = self.backend.timeout
-        self.backend.timeout = 60  # give it up to a minute to do sweep
+        for i in range(0, len(voltages), self.list_length):
+            voltage_string = ', '.join([f'{voltage}' for voltage in voltages[i:i + self.list_length]])
+            self.write('empyric_append({%s})' % voltage_string)
 
-        start = datetime.datetime.now()
-        for voltage_list in voltage_lists:
+        self.uploaded_voltages = voltages
 
-            voltage_string = ', '.join([f'{voltage}' for voltage in voltage_list])
+    def _fetch_currents(self, first, last):
+        # Read a range of the buffer as little-endian single precision floats
 
-            self.write('vlist = {%s}' % voltage_string)
-            self.write(f'SweepVListMeasureI(smua, vlist, 0.01, {len(voltage_list)})')
-            raw_response = self.query(f'printbuffer(1, {len(voltage_list)}, smua.nvbuffer1)').strip()
-            current_list += [float(current_str) for current_str in raw_response.split(',')]
+        self.write('format.data = format.REAL32')
+        self.write('format.byteorder = format.LITTLEENDIAN')
+        currents = self.query_binary(f'printbuffer({first}, {last}, smua.nvbuffer1.readings)',
+                                     dtype='<f4', count=last - first + 1)
+        self.write('format.data = format.ASCII')
 
-            self.set_voltage(voltage_list[-1])  # hold last voltage until next sub-sweep
+        return currents.astype(float)
 
-        end = datetime.datetime.now()
+    def stream_fast_currents(self):
+        """
+        Run the fast IV sweep, yielding currents as they are measured
 
-        self.connection.timeout = normal_timeout  # put it back
+        :return: (generator) arrays of new currents
+        """
 
-        self.write('display.screen = display.SMUA')
-        self.write('display.smua.measure.func = display.MEASURE_DCAMPS')
+        try:
+            if len(self.fast_voltages) == 0:
+                raise ValueError('Fast IV sweep voltages have not been set!')
+        except (AttributeError, TypeError):
+            raise ValueError('Fast IV sweep voltages have not been set!')
+
+        voltages = np.asarray(self.fast_voltages, dtype=float)
 
-        return np.array(current_list)
+        with self.transaction():
+            if self.source != 'voltage':
+                self.set_source('voltage')
+
+            self.set_output('ON')  # the output is shut off when the source mode is changed
+
+            self.set_source_delay(self.source_delay)
+
+            self._load_sweep_script()
+            self._upload_voltages(voltages)
+            self.write(f'empyric_sweep({self.settle_time})')
+
+        yield from self.stream_buffer('fast currents', len(voltages),
+                                      lambda: float(self.query('print(smua.nvbuffer1.n)')), self._fetch_currents)
+
+        with self.transaction():
+            self.write('smua.measure.delay = smua.DELAY_AUTO')  # back to the default for single measurements
+            self.set_voltage(voltages[-1])  # hold last voltage
+
+            self.write('display.screen = display.SMUA')
+            self.write('display.smua.measure.func = display.MEASURE_DCAMPS')
+
+    @measurer
+    def measure_fast_currents(self):
+        return np.concatenate(list(self.stream_fast_currents()))
 
     @setter
     def set_source_delay(self,delay):
@@ -2,7 +2,58 @@ from empyric.adapters import *
 from empyric.collection.instrument import *
 
 
-class Keithley2260B(Instrument):
+class SettlingSupply(Instrument):
+    """
+    Base class of power supplies whose measurements lag behind changes of their output or its limits; within the
+    settle time after a change, measurements give no reading (NaN), and the instrument is not queried
+    """
+
+    last_change = 0  # time of the last change of the output or its limits
+
+    @property
+    def settling(self):
+        # whether the output is still within the settle time of its last change
+        return time.time() < self.last_change + self.settle_time
+
+    @setter
+    def set_settle_time(self, settle_time):
+        pass  # only used by the driver
+
+    @measurer
+    def measure_current(self):
+
+        if self.settling:
+            return float('nan')
+
+        return float(self.query('MEAS:CURR?'))
+
+    @measurer
+    def measure_voltage(self):
+
+        if self.settling:
+            return float('nan')
+
+        return float(self.query('MEAS:VOLT?'))
+
+    def measure_many(self, meters):
+
+        if not {'voltage', 'current'}.issubset(meters):
+            return Instrument.measure_many(self, meters)
+
+        with self.transaction():
+            # one query returns both voltage and current
+            if self.settling:
+                voltage, current = float('nan'), float('nan')
+            else:
+                voltage, current = [float(value) for value in self.query('MEAS:ALL?').split(',')]
+
+            others = [meter for meter in meters if meter not in ('voltage', 'current')]
+            measurements = {'voltage': voltage, 'current': current, **Instrument.measure_many(self, others)}
+
+        return {meter: measurements[meter] for meter in meters}
+
+
+class Keithley2260B(SettlingSupply):
     """
     Keithley 2260B power supply, usually either 360 W or 720 W
     """
@@ -17,30 +68,28 @@ class Keithley2260B(Instrument):
     knobs = (
         'max voltage',
         'max current',
-        'output'
+        'output',
+        'settle time'  # time after a change of the output or its limits in which measurements give NaN, in seconds
     )
 
-    # no presets or postsets for this instrument
+    presets = {
+        'settle time': 1.0
+    }
+
+    # no postsets for this instrument
 
     meters = (
         'voltage',
         'current'
     )
 
-    @measurer
-    def measure_current(self):
-        return [float(self.query('MEAS:CURR?')) for i in range(3)][-1] # sometimes the first measurement is lagged
-
-    @measurer
-    def measure_voltage(self):
-        return [float(self.query('MEAS:VOLT?')) for i in range(3)][-1] # sometimes the first measurement is lagged
-
     @setter
     def set_max_voltage(self, voltage):
         if not self.max_current:
             self.get_max_current()
 
         self.write('APPL %.4f,%.4f' % (voltage, self.max_current))
+        self.last_change = time.time()
 
     @setter
     def set_max_current(self, current):
@@ -48,6 +97,7 @@ class Keithley2260B(Instrument):
             self.get_max_voltage()
 
         self.write('APPL %.4f,%.4f' % (self.max_voltage, current))
+        self.last_change = time.time()
 
     @setter
     def set_output(self, output):
@@ -57,6 +107,8 @@ class Keithley2260B(Instrument):
         elif output == 'OFF':
             self.write('OUTP:STAT:IMM OFF')
 
+        self.last_change = time.time()
+
     @getter
     def get_max_current(self):
         return float(self.query('CURR?'))
@@ -66,7 +118,7 @@ class Keithley2260B(Instrument):
         return float(self.query('VOLT?'))
 
 
-class BK9183B(Instrument):
+class BK9183B(SettlingSupply):
     """
     B&K Precision Model 9183B (35V & 6A / 70V & 3A) power supply
     """
@@ -81,10 +133,15 @@ class BK9183B(Instrument):
     knobs = (
         'max voltage',
         'max current',
-        'output'
+        'output',
+        'settle time'  # time after a change of the output or its limits in which measurements give NaN, in seconds
     )
 
-    # no presets or postsets for this instrument
+    presets = {
+        'settle time': 1.0
+    }
+
+    # no postsets for this instrument
 
     meters = (
         'voltage',
@@ -99,21 +156,17 @@ class BK9183B(Instrument):
         elif output == 'OFF':
             self.write('OUT OFF')
 
-    @measurer
-    def measure_current(self):
-        return [float(self.query('MEAS:CURR?')) for i in range(3)][-1] # sometimes the first measurement is lagged
-
-    @measurer
-    def measure_voltage(self):
-        return [float(self.query('MEAS:VOLT?')) for i in range(3)][-1] # sometimes the first measurement is lagged
+        self.last_change = time.time()
 
     @setter
     def set_max_current(self, current):
         self.write('SOUR:CURR ' + str(current))
+        self.last_change = time.time()
 
     @setter
     def set_max_voltage(self, voltage):
         self.write('SOUR:VOLT ' + str(voltage))
+        self.last_change = time.time()
 
     @getter
     def get_max_current(self):
@@ -18,12 +18,19 @@ class Phidget1101(Instrument):
     )
 
     # Available knobs
-    knobs = ('type',)
+    knobs = (
+        'type',
+        'data interval',
+    )
+
+    presets = {
+        'data interval': 250,  # milliseconds
+    }
 
     # Available meters
     meters = ('temperature',)
 
-    def __init__(self, *args, **kwarhs):
+    def __init__(self, *args, **kwargs):
         self.device_class = importlib.import_module('Phidget22.Devices.TemperatureSensor').TemperatureSensor
         Instrument.__init__(self, *args, **kwargs)
 
@@ -41,6 +48,21 @@ class Phidget1101(Instrument):
 
         self.adapter.set('ThermocoupleType', type_dict[type_])
 
+    @setter
+    def set_data_interval(self, interval):
+        # the device reports temperatures at this interval, and measurements return the latest one
+        self.adapter.watch('Temperature')
+        self.adapter.set('DataInterval', int(interval))
+
     @measurer
     def measure_temperature(self):
         return self.adapter.get('Temperature')
+
+    def temperature_history(self):
+        """
+        Get the temperatures reported by the device since it was connected, up to the adapter's buffer size
+
+        :return: (tuple) arrays of times and temperatures
+        """
+
+        return self.adapter.history('Temperature')
@@ -9,6 +9,7 @@ import pandas as pd
 import warnings
 import threading
 import queue
+from concurrent.futures import ThreadPoolExecutor
 from ruamel.yaml import YAML
 import tkinter as tk
 from tkinter.filedialog import askopenfilename
@@ -18,6 +19,7 @@ yaml = YAML()
 from empyric import instruments as instr
 from empyric import routines as rout
 from empyric import adapters, graphics, control
+from empyric.tables import TableCache
 
 
 class Clock:
@@ -167,10 +169,43 @@ class Experiment:
     STOPPED = 'Stopped'  # Both routines and measurements are stopped
     TERMINATED = 'Terminated'  # Experiment has either finished or has been terminated by the user
 
+    PENDING = float('nan')  # marks the value of a long-running measurement in the step in which it started
+
     def __init__(self, variables, routines=None):
 
         self.variables = variables  # dict of the form {..., name: variable, ...}
 
+        # Meters that their instruments declare as long-running are measured in the background (see __next__)
+        self.long_running = [name for name, variable in variables.items()
+                             if variable.type == 'meter' and variable.meter in variable.instrument.long_meters]
+        self.pending = {}  # background measurements of the form {..., name: (future, step), ...}
+
+        # Each instrument measures all of its long-running meters in one background measurement at a time
+        self.long_groups = {}
+        for name in self.long_running:
+            instrument = variables[name].instrument
+            self.long_groups[instrument] = self.long_groups.get(instrument, []) + [name]
+
+        self.long_executor = ThreadPoolExecutor(max_workers=max(len(self.long_groups), 1))
+
+        # Points streamed by pending measurements so far, of the form {..., name: [..., points, ...], ...}
+        self.partial = {name: [] for name in self.long_running}
+        self.partial_lock = threading.Lock()
+        self.partial_shown = {}  # number of streamed batches already filled into the data set
+
+        for instrument, names in self.long_groups.items():
+            instrument.stream_callback = self._stream_callback(names, instrument.stream_callback)
+
+        # Group the other knobs and meters by the bus of their instruments' adapters;
+        # groups on separate buses are read in parallel, each group in order
+        self.bus_groups = {}
+        for name, variable in variables.items():
+            if variable.type in ['knob', 'meter'] and name not in self.long_running:
+                bus = variable.instrument.adapter.bus
+                self.bus_groups[bus] = self.bus_groups.get(bus, []) + [name]
+
+        self.executor = ThreadPoolExecutor(max_workers=max(len(self.bus_groups), 1))
+
         if routines:
             self.routines = routines  # dictionary of experimental routines of the form {..., name: (variable_name, routine), ...}
             self.end = max(
@@ -201,6 +236,10 @@ class Experiment:
         if self.clock.time > self.end:
             self.terminate()
 
+        # A terminated experiment takes no more readings and starts no more long-running measurements
+        if self.status is Experiment.TERMINATED:
+            raise StopIteration
+
         # Update time
         self.state['time'] = self.clock.time
         self.state.name = datetime.datetime.now()
@@ -214,7 +253,7 @@ class Experiment:
                 # if new value is a path to a CSV file, read in data as numpy array
                 if type(new_value) == str:
                     if 'csv' in new_value:
-                        dataframe = pd.read_csv(new_value)
+                        dataframe = TableCache.read_csv(new_value)
                         new_value = dataframe[name].values
 
                 self.variables[name].value = new_value
@@ -225,18 +264,58 @@ class Experiment:
                     self.state[name] = None
             return self.state
 
-        # Get all variable values
-        for name, variable in self.variables.items():
+        # Get all variable values, first from instruments then from expressions
+        values = {}
+
+        # Long-running measurements are filled into the steps in which they started, once they complete;
+        # a new one is started as soon as the previous one is done, and other steps get no value
+        self._collect_pending()
+
+        self._fill_partial()
+
+        # Instruments stay locked during long-running measurements, so their other variables are not read until then;
+        # their knobs keep the values last set or read, and their meters get no value
+        busy = {self.variables[name].instrument for name in self.pending}
+
+        futures = []
+        for names in self.bus_groups.values():
+            idle = []
+            for name in names:
+                variable = self.variables[name]
 
-            value = variable.value
+                if variable.instrument not in busy:
+                    idle.append(name)
+                elif variable.type == 'knob':
+                    values[name] = getattr(variable.instrument, variable.knob.replace(' ', '_'), None)
+                else:
+                    values[name] = None
 
-            if isinstance(value, np.ndarray): # store array data as CSV files
-                dataframe = pd.DataFrame({name: value}, index=[self.state.name]*len(value))
-                path = name.replace(' ','_') +'_' + self.state.name.strftime('%Y%m%d-%H%M%S') + '.csv'
-                dataframe.to_csv(path)
-                self.state[name] = path
+            futures.append(self.executor.submit(self._read_variables, idle))
+
+        for future in futures:
+            values.update(future.result())
+
+        for instrument, names in self.long_groups.items():
+            if any(name in self.pending for name in names):
+                for name in names:
+                    values[name] = None
             else:
-                self.state[name] = value
+                with self.partial_lock:
+                    for name in names:
+                        self.partial[name] = []
+                        self.partial_shown.pop(name, None)
+
+                future = self.long_executor.submit(self._read_variables, names)
+                for name in names:
+                    self.pending[name] = (future, self.state.name)
+                    values[name] = Experiment.PENDING
+
+        for name, variable in self.variables.items():
+            if variable.type == 'expression':
+                values[name] = variable.value
+
+        for name, variable in self.variables.items():
+            self.state[name] = self._store(name, values[name], self.state.name)
 
         # Append new state to experiment data set
         self.data.loc[self.state.name] = self.state
@@ -249,6 +328,114 @@ class Experiment:
     def __iter__(self):
         return self
 
+    def _read_variables(self, names):
+        # Read a group of variables on one bus; called from the executor, one group per bus.
+        # Each instrument gets one call for all of its knobs and meters.
+
+        instruments = {}
+        for name in names:
+            instruments.setdefault(self.variables[name].instrument, []).append(name)
+
+        values = {}
+        for instrument, group in instruments.items():
+
+            # an instrument that fails, e.g. after a hung call, gets NaN values without holding up the others
+            try:
+                knobs = [name for name in group if self.variables[name].type == 'knob']
+                meters = [name for name in group if self.variables[name].type == 'meter']
+
+                knob_values, measurements = instrument.read_many(
+                    knobs=[self.variables[name].knob for name in knobs],
+                    meters=[self.variables[name].meter for name in meters]
+                )
+
+                for name in knobs:
+                    values[name] = self.variables[name]._value = knob_values[self.variables[name].knob]
+
+                for name in meters:
+                    values[name] = self.variables[name]._value = measurements[self.variables[name].meter]
+
+            except ConnectionError as error:
+                warnings.warn(f'unable to read {", ".join(group)} from {instrument}: {error}')
+                for name in group:
+                    values[name] = self.variables[name]._value = float('nan')
+
+        return values
+
+    def _store(self, name, value, step):
+        # Values are stored as they are, except for array data which is stored in CSV files referenced by path
+
+        if isinstance(value, np.ndarray):
+            dataframe = pd.DataFrame({name: value}, index=[step]*len(value))
+            path = name.replace(' ','_') +'_' + step.strftime('%Y%m%d-%H%M%S') + '.csv'
+            dataframe.to_csv(path)
+            return path
+        else:
+            return value
+
+    def _stream_callback(self, names, forward=None):
+        # Make a stream callback which collects the points of an instrument's pending measurements as they come in;
+        # it is called on the thread of the measurement, and passes the points on to any callback already in place
+
+        def callback(meter, points):
+
+            with self.partial_lock:
+                for name in names:
+                    if self.variables[name].meter == meter:
+                        self.partial[name].append(points)
+
+            if forward:
+                forward(meter, points)
+
+        return callback
+
+    def streamed_points(self, name):
+        """
+        Get the number of points streamed so far by the pending measurement of a long-running meter
+
+        :param name: (str) name of the variable
+        :return: (int) number of points
+        """
+
+        with self.partial_lock:
+            return sum(len(points) for points in self.partial.get(name, []))
+
+    def _fill_partial(self):
+        # Fill the points streamed so far by pending measurements into the steps in which they started, so that
+        # plots show the progress of the measurements
+
+        for name, (future, step) in self.pending.items():
+
+            with self.partial_lock:
+                batches = list(self.partial[name])
+
+            if batches and len(batches) != self.partial_shown.get(name) and step in self.data.index:
+                self.data.at[step, name] = self._store(name, np.concatenate(batches), step)
+                self.partial_shown[name] = len(batches)
+
+    def _collect_pending(self, wait=False):
+        # Fill completed background measurements into the data set
+
+        for name, (future, step) in list(self.pending.items()):
+
+            if not (wait or future.done()):
+                continue
+
+            self.pending.pop(name)
+
+            try:
+                value = future.result()[name]
+            except BaseException as error:
+                warnings.warn(f'measurement of {name} started at {step} failed with {type(error).__name__}: {error}')
+                value = float('nan')
+
+            stored_value = self._store(name, value, step)
+
+            if step in self.data.index:
+                self.data.at[step, name] = stored_value
+            if step == self.state.name:
+                self.state[name] = stored_value
+
     def save(self, directory=None):
 
         path = f"data_{self.timestamp}.csv"
@@ -272,6 +459,7 @@ class Experiment:
 
     def terminate(self):
         self.stop()
+        self._collect_pending(wait=True)
         self.save()
         self.status = Experiment.TERMINATED
 
@@ -288,24 +476,31 @@ def build_experiment(runcard, instruments=None):
     if instruments is None:
         instruments = {}
 
-    for name, specs in runcard['Instruments'].items():
+    # Connect to the instruments in parallel; communications on shared buses are serialized by the adapters
+    with ThreadPoolExecutor(max_workers=max(len(runcard['Instruments']), 1)) as executor:
 
-        specs = specs.copy()  # avoids modifying the runcard
+        futures = {}
+        for name, specs in runcard['Instruments'].items():
 
-        instrument_name = specs.pop('type')
-        address = specs.pop('address')
+            specs = specs.copy()  # avoids modifying the runcard
 
-        # Grab any keyword arguments for the adapter
-        adapter_kwargs = {}
-        for kwarg in adapters.Adapter.kwargs:
-            if kwarg.replace('_', ' ') in specs:
-                adapter_kwargs[kwarg] = specs.pop(kwargs)
+            instrument_name = specs.pop('type')
+            address = specs.pop('address')
 
-        # Any remaining keywards are instrument presets
-        presets = specs
+            # Grab any keyword arguments for the adapter
+            adapter_kwargs = {}
+            for kwarg in adapters.Adapter.kwargs:
+                if kwarg.replace('_', ' ') in specs:
+                    adapter_kwargs[kwarg] = specs.pop(kwarg.replace('_', ' '))
 
-        instrument_class = instr.__dict__[instrument_name]
-        instruments[name] = instrument_class(address=address, presets=presets, **adapter_kwargs)
+            # Any remaining keywards are instrument presets
+            presets = specs
+
+            instrument_class = instr.__dict__[instrument_name]
+            futures[name] = executor.submit(instrument_class, address=address, presets=presets, **adapter_kwargs)
+
+        for name, future in futures.items():
+            instruments[name] = future.result()
 
     variables = {}  # experiment variables, associated with the instruments above
     for name, specs in runcard['Variables'].items():
@@ -438,9 +633,15 @@ class Manager:
 
         experiment_thread.join()
 
-        # Disconnect instruments
-        for instrument in self.instruments.values():
-            instrument.disconnect()
+        # Disconnect instruments in parallel
+        with ThreadPoolExecutor(max_workers=max(len(self.instruments), 1)) as executor:
+            futures = {name: executor.submit(instrument.disconnect) for name, instrument in self.instruments.items()}
+
+            for name, future in futures.items():
+                try:
+                    future.result()
+                except BaseException as error:
+                    warnings.warn(f'Encountered {error} while disconnecting {name}')
 
         os.chdir(top_dir)  # return to the parent directory
 
@@ -437,7 +437,13 @@ class ExperimentGUI:
         # Check the state of the experiment
         state = self.experiment.state
         for name, label in self.variable_status_labels.items():
-            if state[name] == None:
+            if name in self.experiment.pending:
+                points = self.experiment.streamed_points(name)
+                if points:
+                    label.config(text=f'pending ({points} points)')
+                else:
+                    label.config(text='pending')
+            elif state[name] == None:
                 label.config(text='none')
             elif state[name] == np.nan:
                 label.config(text='nan')
@@ -2,10 +2,11 @@ import time
 import numbers
 import numpy as np
 import pandas as pd
+import bisect
 from importlib import import_module
-from scipy.interpolate import interp1d
 
 from empyric.control import PIDController
+from empyric.tables import TableCache
 
 def convert_time(time_value):
     """
@@ -38,6 +39,75 @@ def convert_time(time_value):
         else:
             raise ValueError(f'Unrecognized time format for {time_value}!')
 
+
+class Schedule:
+    """
+    Piecewise schedule of values at given times, which is set up once so that looking up the value at a given time is
+    cheap; numeric values are interpolated linearly between their times, and other values are held until the next time
+    """
+
+    def __init__(self, times, values):
+        """
+
+        :param times: (iterable) times of the values, in ascending order
+        :param values: (iterable) values at those times
+        """
+
+        self.times = [float(time) for time in times]
+        self.values = list(values)
+
+        if len(self.times) != len(self.values):
+            raise ValueError('schedule times must match the values in length!')
+
+        if len(self.times) == 0:
+            raise ValueError('schedule must have at least one time and value!')
+
+        if any(later < earlier for earlier, later in zip(self.times[:-1], self.times[1:])):
+            raise ValueError('schedule times must be in ascending order!')
+
+        self.numeric = all(isinstance(value, numbers.Number) for value in self.values)
+
+        self.cursor = 0  # index of the segment of the last lookup, which is usually also the segment of the next one
+
+    def _segment(self, time):
+        # Find the index i of the segment such that times[i] <= time < times[i+1]
+
+        times = self.times
+        i = self.cursor
+
+        # experiment time usually stays in the same segment or moves on to the next one
+        for j in (i, i + 1):
+            if j + 1 < len(times) and times[j] <= time < times[j + 1]:
+                self.cursor = j
+                return j
+
+        self.cursor = min(bisect.bisect_right(times, time) - 1, len(times) - 1)
+        return self.cursor
+
+    def __call__(self, time):
+        """
+        Look up the value of the schedule at a given time
+
+        :param time: (float) time
+        :return: (float/str) value at that time
+        """
+
+        if time < self.times[0] or time > self.times[-1]:
+            raise ValueError(f'time {time} is outside of the schedule, from {self.times[0]} to {self.times[-1]}')
+
+        i = self._segment(time)
+
+        if i == len(self.times) - 1:  # at the last time
+            return self.values[i]
+
+        if self.numeric:
+            t0, t1 = self.times[i], self.times[i + 1]
+            v0, v1 = self.values[i], self.values[i + 1]
+            return v0 + (v1 - v0) * (time - t0) / (t1 - t0)
+        else:
+            return self.values[i]
+
+
 ## Routines ##
 
 class Routine:
@@ -57,7 +127,7 @@ class Routine:
             self.__setattr__(key, value)
 
         if 'csv' in kwargs.get('values', ''):  # values can be specified in a CSV file
-            df = pd.read_csv(kwargs['values'])
+            df = TableCache.read_csv(kwargs['values'])
             self.values = df[df.columns[-1]].values
 
             if len(df.columns) > 1 and 'times' not in kwargs:
@@ -67,29 +137,23 @@ class Routine:
                 except IndexError:
                     pass
 
-        # Make an interpolator if there are multiple times and values
+        # Compile a schedule if there are multiple times and values
         if hasattr(self, 'values') and hasattr(self, 'times'):
-            if len(kwargs['times']) != len(kwargs['values']):
+            if len(self.times) != len(self.values):
                 raise ValueError('Routine times keyword argument must match length of values keyword argument!')
 
-            if isinstance(kwargs['values'][0], numbers.Number):
-                self.interpolator = interp1d(kwargs['times'], kwargs['values'])
-            else:
-                def interpolator(_time):
-                    return kwargs['values'][np.argwhere(np.array(kwargs['times'])<_time).flatten()[-1]]
-
-                self.interpolator = interpolator
+            self.schedule = Schedule(self.times, self.values)
 
         # Register the start and end of the routine
         if not 'start' in kwargs:
-            if 'times' in kwargs:
-                self.start = kwargs['times'][0]
+            if hasattr(self, 'times'):
+                self.start = self.times[0]
             else:
                 self.start = -np.inf
 
         if not 'end' in kwargs:
-            if 'times' in kwargs:
-                self.end = kwargs['times'][-1]
+            if hasattr(self, 'times'):
+                self.end = self.times[-1]
             else:
                 self.end = np.inf
 
@@ -136,7 +200,7 @@ class Timecourse(Routine):
     def __call__(self, state):
 
         try:
-            new_value = float(self.interpolator(state['time']))
+            new_value = float(self.schedule(state['time']))
         except ValueError:  # happens when outside the routine times
             return None
 
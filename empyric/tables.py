@@ -0,0 +1,80 @@
+# This submodule keeps tables read from data files, which routines and instruments may use repeatedly
+
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class TableCache:
+    """
+    Shared cache of tables read from CSV files; a cached table is reused for as long as its file is unchanged, as
+    indicated by its modification time and size, and the least recently used tables are dropped beyond max_size
+    """
+
+    max_size = 16  # maximum number of cached tables
+
+    tables = OrderedDict()  # cached tables of the form {..., (path, options): (mtime, size, table), ...}
+    lock = threading.Lock()
+
+    @staticmethod
+    def find(path):
+        """
+        Find a table file; relative paths are also looked up one level up, since experiments run in their own
+        data directories below the directory of the runcard
+
+        :param path: (str) path to the file
+        :return: (str) absolute path to the file
+        """
+
+        for candidate in [path, os.path.join('..', path)]:
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+
+        raise FileNotFoundError(f'table file {path} not found!')
+
+    @staticmethod
+    def read_csv(path, **kwargs):
+        """
+        Read a table from a CSV file, or get it from the cache if the file has not changed since it was last read.
+        The table is shared with other users of the cache, so it should not be modified.
+
+        :param path: (str) path to the file
+        :param kwargs: (dict) any keyword arguments for pandas.read_csv
+        :return: (pandas.DataFrame) table
+        """
+
+        path = TableCache.find(path)
+        status = os.stat(path)
+
+        key = (path, tuple(sorted(kwargs.items())))
+
+        with TableCache.lock:
+            if key in TableCache.tables:
+                mtime, size, table = TableCache.tables[key]
+
+                if (mtime, size) == (status.st_mtime_ns, status.st_size):
+                    TableCache.tables.move_to_end(key)
+                    return table
+
+        table = pd.read_csv(path, **kwargs)
+
+        with TableCache.lock:
+            TableCache.tables[key] = (status.st_mtime_ns, status.st_size, table)
+            TableCache.tables.move_to_end(key)
+
+            while len(TableCache.tables) > TableCache.max_size:
+                TableCache.tables.popitem(last=False)
+
+        return table
+
+    @staticmethod
+    def clear():
+        """
+        Empty the cache
+        """
+
+        with TableCache.lock:
+            TableCache.tables.clear()
+
@@ -0,0 +1,51 @@
+# Shared fixtures of the tests: local servers which stand in for networked instruments and gateways
+
+import socketserver
+import threading
+
+import pytest
+
+
+class LocalServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded TCP server on a free port of the loopback interface; subclasses provide the protocol-specific handler
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    handler = None  # socketserver.BaseRequestHandler subclass serving each connection
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), self.handler)
+
+        self.connections = 0  # number of connections accepted so far
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        socketserver.ThreadingTCPServer.process_request(self, request, client_address)
+
+
+@pytest.fixture
+def serve():
+    """
+    Start local servers of the given LocalServer subclasses, and shut them down after the test
+    """
+
+    servers = []
+
+    def start(server_class):
+        server = server_class()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,93 @@
+# Tests of the generic adapter behavior: deadlines on calls and the reuse of worker threads
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from empyric.adapters import Adapter, bounded, chaperone
+
+
+class StubAdapter(Adapter):
+    """
+    Adapter without a backend, whose writes and queries hang while its hang event is set
+    """
+
+    call_deadline = 0.2
+    recovery_interval = 0
+
+    def connect(self):
+        self.hang = threading.Event()
+        self.threads = []
+        self.connected = True
+
+    def _wait(self):
+        self.threads.append(threading.current_thread())
+        if self.hang.is_set():
+            time.sleep(1)
+
+    @bounded
+    def write(self, message):
+        self._wait()
+
+    @chaperone
+    def query(self, question):
+        self._wait()
+        return question
+
+
+def stub():
+    return StubAdapter(SimpleNamespace(address=1))
+
+
+def test_calls_reuse_one_worker():
+
+    adapter = stub()
+
+    adapter.write('A')
+    adapter.query('B?')
+    adapter.write('C')
+
+    assert len(set(adapter.threads)) == 1
+    assert adapter.threads[0] is not threading.current_thread()
+
+
+def test_hung_write_is_abandoned():
+
+    adapter = stub()
+    adapter.hang.set()
+
+    start = time.time()
+    with pytest.raises(ConnectionError):
+        adapter.write('A')
+
+    assert time.time() - start < 0.9
+    assert adapter.suspect and not adapter.connected
+
+    # the adapter reconnects on the next call, on a new worker
+    hung_worker = adapter.threads[0]
+    adapter.hang.clear()
+
+    assert adapter.query('B?') == 'B?'
+    assert not adapter.suspect
+    assert adapter.threads[-1] is not hung_worker
+
+
+def test_unsupported_binary_transfer():
+
+    adapter = stub()
+
+    with pytest.raises(NotImplementedError):
+        adapter.query_binary('CURV?')
+
+    with pytest.raises(NotImplementedError):
+        adapter.read_binary_block()
+
+    # the call is not repeated, and the adapter is not reconnected
+    assert adapter.repeats == 0 and adapter.reconnects == 0
+    assert adapter.connected and not adapter.suspect
+    assert len(adapter.threads) == 1  # only the write of the query
+
+    with pytest.raises(NotImplementedError):
+        Adapter(SimpleNamespace(address=1)).query_binary('CURV?')
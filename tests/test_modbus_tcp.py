@@ -0,0 +1,223 @@
+# Tests of the ModbusTCP adapter against a local stand-in Modbus TCP server
+
+import socketserver
+import struct
+from types import SimpleNamespace
+
+import pytest
+from conftest import LocalServer
+
+from empyric.adapters import ModbusError, ModbusTCP, encode_registers
+
+
+class ModbusHandler(socketserver.BaseRequestHandler):
+
+    def receive_exactly(self, count):
+
+        data = b''
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+
+        return data
+
+    def handle(self):
+
+        pending = []
+        while True:
+            try:
+                transaction_id, protocol, length, unit = struct.unpack('>HHHB', self.receive_exactly(7))
+                pdu = self.receive_exactly(length - 1)
+            except (ConnectionError, OSError):
+                return
+
+            pending.append((transaction_id, unit, self.server.respond(unit, pdu)))
+
+            if len(pending) >= self.server.batch:
+                for transaction_id, unit, response in reversed(pending):
+                    header = struct.pack('>HHHB', transaction_id, 0, len(response) + 1, unit)
+                    self.request.sendall(header + response)
+                pending = []
+
+
+class ModbusServer(LocalServer):
+    """
+    Minimal Modbus TCP server with holding registers for each unit, supporting function codes 3, 6 and 16
+
+    With batch set to n > 1, the server collects n requests before answering them in reverse order, as a gateway
+    serving several devices might.
+    """
+
+    handler = ModbusHandler
+
+    def __init__(self):
+        LocalServer.__init__(self)
+
+        self.registers = {}  # of the form {..., (unit, address): value, ...}
+        self.requests = []  # (unit, function code) of each request received
+        self.batch = 1
+        self.faulty_units = set()  # units which answer every request with an exception response
+
+    def respond(self, unit, pdu):
+
+        self.requests.append((unit, pdu[0]))
+
+        if unit in self.faulty_units:
+            return struct.pack('>BB', pdu[0] | 0x80, 4)  # server device failure
+
+        if pdu[0] == 3:
+            start, count = struct.unpack('>HH', pdu[1:5])
+            values = [self.registers.get((unit, start + i), 0) for i in range(count)]
+            return struct.pack('>BB%dH' % count, 3, 2 * count, *values)
+
+        elif pdu[0] == 6:
+            address, value = struct.unpack('>HH', pdu[1:5])
+            self.registers[(unit, address)] = value
+            return pdu
+
+        elif pdu[0] == 16:
+            start, count = struct.unpack('>HH', pdu[1:5])
+            values = struct.unpack('>%dH' % count, pdu[6:6 + 2 * count])
+            for i, value in enumerate(values):
+                self.registers[(unit, start + i)] = value
+            return pdu[:5]
+
+        else:
+            return struct.pack('>BB', pdu[0] | 0x80, 1)  # illegal function
+
+
+@pytest.fixture
+def server(serve):
+    return serve(ModbusServer)
+
+
+def connect(server, unit=1):
+    instrument = SimpleNamespace(address='127.0.0.1:%d::%d' % (server.port, unit))
+    return ModbusTCP(instrument)
+
+
+def test_read_and_write_registers(server):
+
+    adapter = connect(server)
+
+    adapter.write(10, 1234)
+    assert adapter.read(10) == 1234
+    assert server.registers[(1, 10)] == 1234
+
+    adapter.write(20, -5, type='int32')
+    assert adapter.read(20, type='int32') == -5
+
+    adapter.disconnect()
+
+
+@pytest.mark.parametrize('byte_order', [0, 1, 2, 3])
+def test_float_byte_orders(server, byte_order):
+
+    adapter = connect(server)
+
+    for i, word in enumerate(encode_registers(3.25, 'float', byte_order)):
+        server.registers[(1, 30 + i)] = word
+
+    assert adapter.read(30, type='float', byte_order=byte_order) == 3.25
+
+    adapter.disconnect()
+
+
+def test_read_map_coalesces_blocks(server):
+
+    adapter = connect(server)
+
+    server.registers.update({(1, 0): 7, (1, 1): 8, (1, 100): 9})
+    for i, word in enumerate(encode_registers(1.5, 'float')):
+        server.registers[(1, 4 + i)] = word
+
+    register_map = {
+        'a': (0, 'uint16', 1, 0),
+        'b': (1, 'uint16', 0.5, 0),
+        'c': (4, 'float', 1, 0),
+        'd': (100, 'uint16', 1, 0),
+    }
+
+    values = adapter.read_map(register_map)
+
+    assert values == {'a': 7, 'b': 4, 'c': 1.5, 'd': 9}
+    assert server.requests == [(1, 3), (1, 3)]  # registers 0 to 5 in one block and register 100 in another
+
+    adapter.disconnect()
+
+
+def test_pipelined_responses_out_of_order(server):
+
+    adapter = connect(server)
+    server.batch = 2
+
+    server.registers.update({(1, 0): 1, (1, 200): 2})
+
+    values = adapter.read_map({'first': (0, 'uint16', 1, 0), 'second': (200, 'uint16', 1, 0)})
+
+    assert values == {'first': 1, 'second': 2}
+
+    adapter.disconnect()
+
+
+def test_units_share_one_connection(server):
+
+    first = connect(server, unit=1)
+    second = connect(server, unit=2)
+
+    assert first.backend is second.backend
+
+    first.write(0, 11)
+    second.write(0, 22)
+
+    assert first.read(0) == 11
+    assert second.read(0) == 22
+    assert server.connections == 1
+
+    first.disconnect()
+
+    assert second.read(0) == 22  # the connection stays open for the remaining device
+
+    second.disconnect()
+
+    assert ('127.0.0.1', server.port) not in ModbusTCP.gateways
+
+
+def test_exception_response(server):
+
+    adapter = connect(server)
+
+    with pytest.raises(ModbusError) as error:
+        adapter.backend.request(1, struct.pack('>BHH', 4, 0, 1))  # input registers are not served
+
+    assert (error.value.function, error.value.code) == (4, 1)
+    assert not adapter.backend.broken
+
+    adapter.disconnect()
+
+
+def test_exception_response_keeps_shared_connection(server):
+
+    first = connect(server, unit=1)
+    second = connect(server, unit=2)
+
+    gateway = first.backend
+    server.faulty_units.add(1)
+
+    with pytest.warns(UserWarning), pytest.raises(ConnectionError):
+        first.read(0)  # repeated and reconnected by the chaperone, then given up
+
+    assert not gateway.broken
+
+    server.registers[(2, 0)] = 22
+    assert second.read(0) == 22
+
+    third = connect(server, unit=3)
+
+    assert first.backend is second.backend is third.backend is gateway
+    assert server.connections == 1
+
+    for adapter in (first, second, third):
+        adapter.disconnect()
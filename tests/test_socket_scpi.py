@@ -0,0 +1,117 @@
+# Tests of the SocketSCPI adapter against a local stand-in SCPI server
+
+import socketserver
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from conftest import LocalServer
+
+from empyric.adapters import SocketSCPI
+
+# values whose bytes include the termination character, which must not end a binary block early
+curve = np.frombuffer(b'\n\x00\x80\x3f' * 3 + b'\x00\x00\x0a\x41', dtype='<f4')
+
+
+class SCPIHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        for line in self.rfile:
+            self.wfile.write(self.server.respond(line.decode().strip()))
+
+
+class SCPIServer(LocalServer):
+    """
+    Minimal SCPI server answering text queries and sending a curve as definite- or indefinite-length binary blocks
+    """
+
+    handler = SCPIHandler
+
+    def __init__(self):
+        LocalServer.__init__(self)
+
+        self.settings = {'*IDN?': 'Stand-in SCPI server'}
+        self.commands = []  # commands and queries received
+
+    def respond(self, message):
+
+        self.commands.append(message)
+
+        if message == 'CURV?':
+            data = curve.tobytes()
+            length = str(len(data)).encode()
+            return b'#' + str(len(length)).encode() + length + data + b'\n'
+        elif message == 'CURV:INDEF?':
+            return b'#0' + curve.tobytes() + b'\n'
+        elif message.endswith('?'):
+            return self.settings.get(message, '0').encode() + b'\n'
+        else:
+            name, value = message.split(' ', 1)
+            self.settings[name + '?'] = value
+            return b''
+
+
+@pytest.fixture
+def server(serve):
+    return serve(SCPIServer)
+
+
+@pytest.fixture
+def adapter(server):
+
+    adapter = SocketSCPI(SimpleNamespace(address='127.0.0.1:%d' % server.port))
+
+    yield adapter
+
+    adapter.disconnect()
+
+
+def test_address(server, adapter):
+    assert adapter.host_and_port == ('127.0.0.1', server.port)
+    assert adapter.bus_key == 'TCPIP::127.0.0.1:%d' % server.port
+
+
+def test_query(adapter):
+    assert adapter.query('*IDN?') == 'Stand-in SCPI server'
+
+
+def test_write_then_read(server, adapter):
+
+    adapter.write('VOLT 1.5')
+    adapter.write('VOLT?')
+
+    assert adapter.read() == '1.5'
+    assert server.commands == ['VOLT 1.5', 'VOLT?']
+
+
+@pytest.mark.parametrize('pipeline', [True, False])
+def test_query_many(server, adapter, pipeline):
+
+    server.settings.update({'VOLT?': '1', 'CURR?': '2'})
+
+    assert adapter.query_many(['VOLT?', 'CURR?', '*IDN?'], pipeline=pipeline) == ['1', '2', 'Stand-in SCPI server']
+
+
+def test_definite_binary_block(adapter):
+
+    data = adapter.query_binary('CURV?', dtype='<f4')
+
+    np.testing.assert_array_equal(data, curve)
+    assert adapter.query('*IDN?') == 'Stand-in SCPI server'  # the termination after the block is consumed
+
+
+def test_indefinite_binary_block(adapter):
+
+    data = adapter.query_binary('CURV:INDEF?', dtype='<f4', count=len(curve))
+
+    np.testing.assert_array_equal(data, curve)
+    assert adapter.query('*IDN?') == 'Stand-in SCPI server'
+
+
+def test_persistent_connection(server, adapter):
+
+    for _ in range(5):
+        adapter.query('*IDN?')
+
+    assert server.connections == 1